@@ -29,8 +29,8 @@ import fcntl
 import json
 import os
 import re
-import urllib.request
 
+from boltlinux.miscellaneous.downloader import Downloader, DownloadError
 from boltlinux.miscellaneous.userinfo import UserInfo
 from boltlinux.distro.config.error import \
         DistroInfoError, ReleaseNotFoundError
@@ -164,13 +164,14 @@ class DistroInfo:
 
     def _fetch_json(self, url, connection_timeout=30):
         try:
-            with urllib.request.urlopen(url, timeout=connection_timeout) \
-                    as response:
-                return json.loads(
-                    response.read().decode("utf-8"),
-                    object_pairs_hook=collections.OrderedDict
-                )
-        except urllib.error.URLError as e:
+            data = b"".join(
+                Downloader().get(url, connection_timeout=connection_timeout)
+            )
+            return json.loads(
+                data.decode("utf-8"),
+                object_pairs_hook=collections.OrderedDict
+            )
+        except DownloadError as e:
             raise DistroInfoError(
                 "error retrieving '{}': {}"
                 .format(url, str(e))
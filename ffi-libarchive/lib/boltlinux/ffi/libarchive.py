@@ -26,6 +26,7 @@
 import os
 import re
 import ctypes
+import mmap
 import stat
 import pwd
 import grp
@@ -57,6 +58,7 @@ COMPRESSION_GZIP = 16
 COMPRESSION_LZMA = 17
 COMPRESSION_XZ = 18
 COMPRESSION_NONE = 19
+COMPRESSION_ZSTD = 20
 
 STATUS_OK = 0
 STATUS_EOF = 1
@@ -94,6 +96,7 @@ _compression_functions = {
     COMPRESSION_LZMA: "archive_write_add_filter_lzma",
     COMPRESSION_XZ: "archive_write_add_filter_xz",
     COMPRESSION_NONE: "archive_write_add_filter_none",
+    COMPRESSION_ZSTD: "archive_write_add_filter_zstd",
     None: "archive_write_add_filter_none"
 }
 
@@ -208,6 +211,8 @@ lib.archive_write_new.argtypes = []
 lib.archive_write_new.restype = ctypes.c_void_p
 lib.archive_write_open_filename.argtypes = [ctypes.c_void_p, ctypes.c_char_p]
 lib.archive_write_open_filename.restype = ctypes.c_int
+lib.archive_write_open_fd.argtypes = [ctypes.c_void_p, ctypes.c_int]
+lib.archive_write_open_fd.restype = ctypes.c_int
 lib.archive_write_data.argtypes = \
     [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_size_t]
 lib.archive_write_data.restype = ctypes.c_ssize_t
@@ -217,6 +222,13 @@ lib.archive_write_free.restype = ctypes.c_int
 lib.archive_read_data.argtypes = \
     [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_size_t]
 lib.archive_read_data.restype = ctypes.c_ssize_t
+lib.archive_read_data_block.argtypes = [
+    ctypes.c_void_p,
+    ctypes.POINTER(ctypes.c_void_p),
+    ctypes.POINTER(ctypes.c_size_t),
+    ctypes.POINTER(ctypes.c_int64)
+]
+lib.archive_read_data_block.restype = ctypes.c_int
 lib.archive_read_new.argtypes = []
 lib.archive_read_new.restype = ctypes.c_void_p
 lib.archive_read_next_header2.argtypes = [ctypes.c_void_p, ctypes.c_void_p]
@@ -224,6 +236,9 @@ lib.archive_read_next_header2.restype = ctypes.c_int
 lib.archive_read_open_filename.argtypes = \
     [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_ulong]
 lib.archive_read_open_filename.restype = ctypes.c_int
+lib.archive_read_open_memory.argtypes = \
+    [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_size_t]
+lib.archive_read_open_memory.restype = ctypes.c_int
 lib.archive_read_support_filter_all.argtypes = [ctypes.c_void_p]
 lib.archive_read_support_filter_all.restype = ctypes.c_int
 lib.archive_read_support_filter_program.argtypes = \
@@ -236,6 +251,19 @@ lib.archive_read_support_format_raw.restype = ctypes.c_int
 lib.archive_read_support_format_empty.argtypes = [ctypes.c_void_p]
 lib.archive_read_support_format_empty.restype = ctypes.c_int
 
+_read_callback_t = ctypes.CFUNCTYPE(ctypes.c_ssize_t, ctypes.c_void_p,
+        ctypes.c_void_p, ctypes.POINTER(ctypes.c_void_p))
+_close_callback_t = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p,
+        ctypes.c_void_p)
+
+lib.archive_read_open.argtypes = [ctypes.c_void_p, ctypes.c_void_p,
+        ctypes.c_void_p, _read_callback_t, _close_callback_t]
+lib.archive_read_open.restype = ctypes.c_int
+
+lib.archive_write_add_filter_program.argtypes = \
+    [ctypes.c_void_p, ctypes.c_char_p]
+lib.archive_write_add_filter_program.restype = ctypes.c_int
+
 lib.archive_write_set_option.argtypes = \
     [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_char_p, ctypes.c_char_p]
 lib.archive_write_set_option.restype = ctypes.c_int
@@ -243,7 +271,8 @@ lib.archive_write_set_option.restype = ctypes.c_int
 ############################### IMPLEMENTATION ################################
 
 def error_string(c_archive_p):
-    return lib.archive_error_string(c_archive_p).decode("utf-8")
+    msg = lib.archive_error_string(c_archive_p)
+    return msg.decode("utf-8") if msg else "unknown error"
 
 class ArchiveError(Exception):
     pass
@@ -524,18 +553,32 @@ class ArchiveEntry:
 
 class ArchiveFileWriter:
 
+    # Chunk size for handing file contents to libarchive in write_file.
+    WRITE_CHUNK_SIZE = 1024 * 1024
+
     def __init__(self, filename, archive_format, compression=None,
-            options=None):
+            options=None, cmd=None):
         self._c_archive_p = lib.archive_write_new()
         self._hardlinks = {}
 
-        try:
-            func = getattr(lib, _compression_functions[compression])
-            func(self._c_archive_p)
-        except (KeyError, AttributeError):
-            self.close()
-            raise ArchiveError("invalid or unsupported compression scheme.")
-        #end try
+        if cmd:
+            if lib.archive_write_add_filter_program(self._c_archive_p,
+                    cmd.encode("utf-8")) != STATUS_OK:
+                msg = error_string(self._c_archive_p)
+                self.close()
+                raise ArchiveError(msg)
+            #end if
+        else:
+            try:
+                func = getattr(lib, _compression_functions[compression])
+                func(self._c_archive_p)
+            except (KeyError, AttributeError):
+                self.close()
+                raise ArchiveError(
+                    "invalid or unsupported compression scheme."
+                )
+            #end try
+        #end if
 
         try:
             func = getattr(lib, _format_functions[archive_format])
@@ -550,8 +593,17 @@ class ArchiveFileWriter:
                 self.__set_filter_option(mod, key, val)
         #end if
 
-        if lib.archive_write_open_filename(
-                self._c_archive_p, filename.encode("utf-8")) != STATUS_OK:
+        # An integer is taken to be an open file descriptor. Output starts at
+        # its current offset and the descriptor stays open on close.
+        if isinstance(filename, int):
+            rval = lib.archive_write_open_fd(self._c_archive_p, filename)
+        else:
+            rval = lib.archive_write_open_filename(
+                self._c_archive_p, filename.encode("utf-8")
+            )
+        #end if
+
+        if rval != STATUS_OK:
             msg = error_string(self._c_archive_p)
             self.close()
             raise ArchiveError(msg)
@@ -595,14 +647,52 @@ class ArchiveFileWriter:
     #end function
 
     def write_data(self, data):
-        if not isinstance(data, bytes):
-            msg = "data passed to write_data has to be a 'bytes' string."
+        """
+        Writes `data` to the current entry. Besides 'bytes', writable buffers
+        such as 'bytearray', 'memoryview' or 'mmap' objects are accepted and
+        passed to libarchive without making a copy.
+        """
+        if isinstance(data, bytes):
+            return self.__write_buffer(data, len(data))
+
+        try:
+            view = memoryview(data)
+        except TypeError:
+            msg = "data passed to write_data has to be a bytes-like object."
             raise ValueError(msg)
-        bytes_written = lib.archive_write_data(self._c_archive_p,
-                data, len(data))
-        if bytes_written < 0:
-            raise ArchiveError(error_string(self._c_archive_p))
-        return bytes_written
+        #end try
+
+        with view:
+            if view.readonly:
+                return self.__write_buffer(view.tobytes(), view.nbytes)
+
+            view = view.cast("B")
+            if not view.nbytes:
+                return 0
+
+            c_buffer = (ctypes.c_char * view.nbytes).from_buffer(view)
+            try:
+                return self.__write_buffer(c_buffer, view.nbytes)
+            finally:
+                del c_buffer
+        #end with
+    #end function
+
+    def write_file(self, source):
+        """
+        Writes the contents of `source`, a path or an open file descriptor,
+        to the current entry. Regular files are memory-mapped, everything
+        else is read through a single reusable buffer. Returns the number of
+        bytes written.
+        """
+        if isinstance(source, int):
+            return self.__write_fd(source)
+
+        fd = os.open(source, os.O_RDONLY)
+        try:
+            return self.__write_fd(fd)
+        finally:
+            os.close(fd)
     #end function
 
     def add_file(self, source_file, pathname=None, uname=None, gname=None):
@@ -622,11 +712,66 @@ class ArchiveFileWriter:
 
             self.write_entry(archive_entry)
 
-            with open(source_file, "rb") as f:
-                for chunk in iter(lambda: f.read(4096), b""):
-                    self.write_data(chunk)
+            self.write_file(source_file)
+        #end with
+    #end function
+
+    def __write_buffer(self, c_buffer, size):
+        bytes_written = lib.archive_write_data(self._c_archive_p,
+                c_buffer, size)
+        if bytes_written < 0:
+            raise ArchiveError(error_string(self._c_archive_p))
+        return bytes_written
+    #end function
+
+    def __write_fd(self, fd):
+        st = os.fstat(fd)
+
+        if stat.S_ISREG(st.st_mode) and st.st_size > 0:
+            # ACCESS_COPY yields a writable (private) mapping, which ctypes
+            # can point into. Nothing is copied unless written to.
+            with mmap.mmap(fd, st.st_size, access=mmap.ACCESS_COPY) as m:
+                if hasattr(m, "madvise"):
+                    m.madvise(mmap.MADV_SEQUENTIAL)
+                return self.__write_chunks(m, st.st_size)
             #end with
+        #end if
+
+        buf = bytearray(self.WRITE_CHUNK_SIZE)
+        bytes_written = 0
+
+        with open(fd, "rb", buffering=0, closefd=False) as f:
+            while True:
+                bytes_read = f.readinto(buf)
+                if not bytes_read:
+                    break
+                bytes_written += self.__write_chunks(buf, bytes_read)
+            #end while
         #end with
+
+        return bytes_written
+    #end function
+
+    def __write_chunks(self, buf, size):
+        offset = 0
+
+        while offset < size:
+            count    = min(size - offset, self.WRITE_CHUNK_SIZE)
+            c_buffer = (ctypes.c_char * count).from_buffer(buf, offset)
+
+            try:
+                bytes_written = self.__write_buffer(c_buffer, count)
+            finally:
+                del c_buffer
+
+            # The entry is full.
+            if bytes_written == 0:
+                break
+
+            offset += bytes_written
+        #end while
+
+        return offset
     #end function
 
     def __set_filter_option(self, mod, key, val):
@@ -649,13 +794,30 @@ class ArchiveFileWriter:
 
 class ArchiveFileReader:
 
+    # Size of the buffer reused by read_data and iter_data.
+    DATA_BUFFER_SIZE = 64 * 1024
+
     def __init__(self, filename, cmd=None, raw=False, buf_size=4096):
         self._c_archive_p = lib.archive_read_new()
+        self._buf_size = buf_size
+        self._source = None
+        self._read_buffer = None
+        self._read_error = None
+        self._c_callbacks = None
+        self._data_buffer = None
+
+        # Output arguments for archive_read_data_block.
+        self._c_block_p = ctypes.c_void_p()
+        self._c_block_size = ctypes.c_size_t()
+        self._c_block_offset = ctypes.c_int64()
 
         try:
             self.__init_helper(filename, cmd=cmd, raw=raw)
         except Exception:
-            msg = error_string(self._c_archive_p)
+            if self._read_error is not None:
+                msg = str(self._read_error)
+            else:
+                msg = error_string(self._c_archive_p)
             self.close()
             raise ArchiveError(msg)
         #end try
@@ -685,8 +847,36 @@ class ArchiveFileReader:
                 raise Exception()
         #end if
 
-        if lib.archive_read_open_filename(self._c_archive_p,
-                filename.encode("utf-8"), 4096) != STATUS_OK:
+        if isinstance(filename, str):
+            rval = lib.archive_read_open_filename(self._c_archive_p,
+                    filename.encode("utf-8"), 4096)
+        elif isinstance(filename, (bytes, bytearray, memoryview)):
+            # libarchive does not copy the buffer, keep a reference.
+            if isinstance(filename, bytes):
+                self._source = filename
+                c_buffer_p = ctypes.cast(ctypes.c_char_p(filename),
+                        ctypes.c_void_p)
+            else:
+                self._source = (ctypes.c_char * len(filename))\
+                    .from_buffer_copy(filename)
+                c_buffer_p = ctypes.addressof(self._source)
+            #end if
+            rval = lib.archive_read_open_memory(self._c_archive_p,
+                    c_buffer_p, len(self._source))
+        else:
+            # Anything else is treated as a binary file object, which is
+            # consumed sequentially through its readinto method.
+            self._source = filename
+            self._read_buffer = ctypes.create_string_buffer(self._buf_size)
+            self._c_callbacks = (
+                _read_callback_t(self.__read_callback),
+                _close_callback_t(self.__close_callback)
+            )
+            rval = lib.archive_read_open(self._c_archive_p, None, None,
+                    *self._c_callbacks)
+        #end if
+
+        if rval != STATUS_OK:
             raise Exception()
     #end function
 
@@ -729,24 +919,99 @@ class ArchiveFileReader:
             return archive_entry
         else:
             archive_entry.free()
-            raise ArchiveError(error_string(self._c_archive_p))
+            raise ArchiveError(self.__last_error())
     #end function
 
     def read_data(self, size=0):
+        if size > 0:
+            return self.__read_data(size)
+
         result = []
+        for chunk in self.iter_data():
+            result.append(bytes(chunk))
+        return b"".join(result)
+    #end function
 
-        if size > 0:
-            result = [self.__read_data(size)]
-        else:
+    def readinto(self, buffer):
+        """
+        Reads data of the current entry directly into the writable buffer
+        `buffer` and returns the number of bytes read, 0 at the end.
+        """
+        with memoryview(buffer) as view:
+            view = view.cast("B")
+            if not view.nbytes:
+                return 0
+
+            c_buffer = (ctypes.c_char * view.nbytes).from_buffer(view)
+            try:
+                rval = lib.archive_read_data(self._c_archive_p,
+                        c_buffer, view.nbytes)
+            finally:
+                del c_buffer
+        #end with
+
+        if rval < 0:
+            raise ArchiveError(self.__last_error())
+
+        return rval
+    #end function
+
+    def iter_data(self):
+        """
+        Yields the data of the current entry as memoryviews into a single
+        reused buffer. Each view is only valid until the next iteration.
+        """
+        buf = self.__data_buffer(self.DATA_BUFFER_SIZE)
+
+        with memoryview(buf) as view:
             while True:
-                buf = self.__read_data(8*1024)
-                if not buf:
+                bytes_read = self.readinto(view)
+                if not bytes_read:
                     break
-                result.append(buf)
+                yield view[:bytes_read]
             #end while
-        #end function
+        #end with
+    #end function
 
-        return b"".join(result)
+    def read_data_block(self):
+        """
+        Returns the next block of the current entry as a tuple of the block
+        and its offset in the file, or None at the end. The block points
+        into libarchive's own buffer and is only valid until the next read.
+        Offsets may skip over holes in sparse files.
+        """
+        rval = lib.archive_read_data_block(
+            self._c_archive_p,
+            ctypes.byref(self._c_block_p),
+            ctypes.byref(self._c_block_size),
+            ctypes.byref(self._c_block_offset)
+        )
+
+        if rval == STATUS_EOF:
+            return None
+        if rval != STATUS_OK:
+            raise ArchiveError(self.__last_error())
+
+        size = self._c_block_size.value
+
+        if size:
+            block = memoryview(
+                (ctypes.c_char * size).from_address(self._c_block_p.value)
+            ).cast("B")
+        else:
+            block = memoryview(b"")
+        #end if
+
+        return block, self._c_block_offset.value
+    #end function
+
+    def data_blocks(self):
+        while True:
+            result = self.read_data_block()
+            if result is None:
+                break
+            yield result
+        #end while
     #end function
 
     def unpack_to_disk(self, base_dir=".", strip_components=0,
@@ -769,9 +1034,16 @@ class ArchiveFileReader:
             elif entry.is_file:
                 if sane_file_modes:
                     entry.mode |= 0o600
-                with open(pathname, "wb+") as f:
-                    for chunk in iter(lambda: self.read_data(4096), b""):
-                        f.write(chunk)
+                with open(pathname, "wb") as f:
+                    for block, offset in self.data_blocks():
+                        # Leave holes in sparse files.
+                        if offset != f.tell():
+                            f.seek(offset)
+                        f.write(block)
+                    #end for
+
+                    if f.tell() < entry.size:
+                        f.truncate(entry.size)
                 #end with
                 os.chmod(pathname, entry.mode)
                 # Assume it is sufficient to do this for files.
@@ -790,14 +1062,41 @@ class ArchiveFileReader:
     #end function
 
     def __read_data(self, size):
-        buf = ctypes.create_string_buffer(size)
+        buf = self.__data_buffer(size)
 
         rval = lib.archive_read_data(self._c_archive_p,
                 ctypes.addressof(buf), size)
         if rval < 0:
-            raise ArchiveError(error_string(self._c_archive_p))
+            raise ArchiveError(self.__last_error())
+
+        return ctypes.string_at(buf, rval)
+    #end function
+
+    def __data_buffer(self, size):
+        if self._data_buffer is None or len(self._data_buffer) < size:
+            self._data_buffer = ctypes.create_string_buffer(size)
+        return self._data_buffer
+    #end function
+
+    def __read_callback(self, c_archive_p, client_data, c_buffer_pp):
+        try:
+            bytes_read = self._source.readinto(self._read_buffer)
+        except Exception as e:
+            self._read_error = e
+            return -1
+        #end try
+
+        c_buffer_pp[0] = ctypes.addressof(self._read_buffer)
+        return bytes_read or 0
+    #end function
+
+    def __close_callback(self, c_archive_p, client_data):
+        return STATUS_OK
 
-        return buf[0:rval]
+    def __last_error(self):
+        if self._read_error is not None:
+            return str(self._read_error)
+        return error_string(self._c_archive_p)
     #end function
 
 #end class
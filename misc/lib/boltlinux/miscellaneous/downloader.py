@@ -23,50 +23,415 @@
 # THE SOFTWARE.
 #
 
+import contextlib
 import hashlib
+import http.client
+import json
 import os
 import random
 import string
+import sys
 import tempfile
+import threading
+import urllib.parse
 import urllib.request
 
+from concurrent.futures import ThreadPoolExecutor
+
 from boltlinux.error import BoltError
 
 class DownloadError(BoltError):
     pass
 
+class HTTPError(DownloadError):
+
+    def __init__(self, status, reason, headers=None):
+        super().__init__("HTTP error {}: {}".format(status, reason))
+        self.status  = status
+        self.headers = headers if headers is not None else {}
+
+#end class
+
+class ConnectionPool:
+    """
+    Keeps idle HTTP/1.1 connections around per host, so that consecutive
+    requests to the same server reuse the TCP connection and TLS session.
+    """
+
+    MAX_IDLE_PER_HOST = 8
+    MAX_REDIRECTS     = 10
+
+    USER_AGENT = "Python-urllib/{}.{}".format(*sys.version_info[:2])
+
+    _default_pool = None
+    _default_lock = threading.Lock()
+
+    def __init__(self, max_idle_per_host=None):
+        self._max_idle_per_host = max_idle_per_host or self.MAX_IDLE_PER_HOST
+        self._idle = {}
+        self._lock = threading.Lock()
+    #end function
+
+    @classmethod
+    def default(cls):
+        with cls._default_lock:
+            if cls._default_pool is None:
+                cls._default_pool = cls()
+        return cls._default_pool
+    #end function
+
+    @contextlib.contextmanager
+    def open(self, url, method="GET", headers=None, timeout=30):
+        """
+        Issues a request and yields the http.client.HTTPResponse. Redirects
+        are followed. The connection goes back into the pool if the response
+        body has been read completely.
+        """
+        headers = dict(headers or {})
+
+        for i in range(self.MAX_REDIRECTS + 1):
+            key, conn, response = self._request(url, method, headers, timeout)
+
+            if response.status in [301, 302, 303, 307, 308] and \
+                    response.getheader("Location"):
+                response.read()
+                self._release(key, conn, response)
+
+                location = urllib.parse.urljoin(
+                    url, response.getheader("Location")
+                )
+
+                # Credentials and virtual host are bound to the origin.
+                if urllib.parse.urlsplit(location).netloc != \
+                        urllib.parse.urlsplit(url).netloc:
+                    headers = {
+                        k: v for k, v in headers.items()
+                        if k.lower() not in ["host", "authorization"]
+                    }
+                #end if
+
+                url = location
+                if response.status == 303 and method != "HEAD":
+                    method = "GET"
+                continue
+            #end if
+
+            if response.status >= 400:
+                self._discard(conn)
+                raise HTTPError(response.status, response.reason,
+                        headers=response.msg)
+            #end if
+
+            try:
+                yield response
+            finally:
+                self._release(key, conn, response)
+            return
+        #end for
+
+        raise DownloadError("too many redirects.")
+    #end function
+
+    def clear(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+
+        for connections in idle.values():
+            for conn in connections:
+                conn.close()
+        #end for
+    #end function
+
+    # PRIVATE
+
+    def _request(self, url, method, headers, timeout):
+        parts = urllib.parse.urlsplit(url)
+
+        if parts.scheme not in ["http", "https"]:
+            raise DownloadError(
+                "unsupported URL scheme '{}'.".format(parts.scheme)
+            )
+
+        proxy = None
+        if not urllib.request.proxy_bypass(parts.hostname or ""):
+            proxy = urllib.request.getproxies().get(parts.scheme)
+
+        key  = (parts.scheme, parts.netloc, proxy)
+        path = urllib.parse.urlunsplit(("", "", parts.path or "/",
+            parts.query, ""))
+
+        # Plain HTTP through a proxy takes the absolute URL.
+        if proxy and parts.scheme == "http":
+            path = url
+
+        # Each hop gets its own headers, so that Host follows redirects.
+        headers = dict(headers)
+        headers.setdefault("Host", parts.netloc)
+        headers.setdefault("Connection", "keep-alive")
+        headers.setdefault("User-Agent", self.USER_AGENT)
+
+        while True:
+            conn, reused = self._acquire(key, parts, proxy, timeout)
+
+            try:
+                conn.request(method, path, headers=headers)
+                return key, conn, conn.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError,
+                    BrokenPipeError):
+                conn.close()
+                # The server dropped an idle connection, try a fresh one.
+                if reused:
+                    continue
+                raise
+            except Exception:
+                conn.close()
+                raise
+            #end try
+        #end while
+    #end function
+
+    def _acquire(self, key, parts, proxy, timeout):
+        with self._lock:
+            connections = self._idle.get(key)
+            if connections:
+                conn = connections.pop()
+                conn.timeout = timeout
+                if conn.sock is not None:
+                    conn.sock.settimeout(timeout)
+                return conn, True
+            #end if
+        #end with
+
+        if parts.scheme == "https":
+            conn_class = http.client.HTTPSConnection
+        else:
+            conn_class = http.client.HTTPConnection
+
+        if proxy:
+            proxy_parts = urllib.parse.urlsplit(proxy)
+            conn = conn_class(
+                proxy_parts.hostname, proxy_parts.port, timeout=timeout
+            )
+            if parts.scheme == "https":
+                conn.set_tunnel(parts.hostname, parts.port)
+        else:
+            conn = conn_class(parts.hostname, parts.port, timeout=timeout)
+        #end if
+
+        return conn, False
+    #end function
+
+    def _release(self, key, conn, response):
+        if not response.isclosed() or response.will_close:
+            self._discard(conn)
+            return
+
+        with self._lock:
+            connections = self._idle.setdefault(key, [])
+            if len(connections) < self._max_idle_per_host:
+                connections.append(conn)
+                return
+        #end with
+
+        self._discard(conn)
+    #end function
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+    #end function
+
+#end class
+
 class Downloader:
 
-    def __init__(self, progress_bar_class=None):
+    MIN_SEGMENT_SIZE = 8 * 1024 * 1024
+
+    def __init__(self, progress_bar_class=None, pool=None):
         self._progress_bar_class = progress_bar_class
+        self._pool = pool or ConnectionPool.default()
 
     def get(self, url, digest=None, connection_timeout=30):
-        progress_bar = None
-        bytes_read   = 0
-
         try:
-            with urllib.request.urlopen(url, timeout=connection_timeout)\
+            with self._pool.open(url, timeout=connection_timeout) \
                     as response:
-                if self._progress_bar_class and response.length:
-                    progress_bar = self._progress_bar_class(response.length)
-                    progress_bar(0)
+                yield from self._read_response(response, digest=digest)
+        except Exception as e:
+            raise DownloadError(
+                'error retrieving "{}": {}'.format(url, str(e))
+            )
+    #end function
+
+    def download_if_modified(self, url, symlink, digest=None,
+            connection_timeout=30, permissions=None):
+        """
+        Revalidates the blob that symlink points to with a single conditional
+        GET. A new blob is only downloaded and symlink only updated if the
+        server reports a change. Returns True if that was the case.
+
+        The blob is named after the server's validators or, if the server
+        sends none, after its contents, so that an unchanged file never
+        produces a new blob.
+        """
+        directory = os.path.dirname(os.path.realpath(symlink))
+
+        if os.path.islink(symlink):
+            old_tag = os.path.basename(os.readlink(symlink))
+        else:
+            old_tag = ""
+
+        old_validators = self._load_validators(directory, old_tag)
+        old_blob_ok    = bool(old_tag) and \
+            os.path.exists(os.path.join(directory, old_tag))
+
+        headers = {}
+
+        if old_blob_ok:
+            if old_validators.get("ETag"):
+                headers["If-None-Match"] = old_validators["ETag"]
+            if old_validators.get("Last-Modified"):
+                headers["If-Modified-Since"] = old_validators["Last-Modified"]
+        #end if
+
+        with tempfile.NamedTemporaryFile(prefix=".download-", dir=directory,
+                delete=False) as f:
+            try:
+                with self._pool.open(url, headers=headers,
+                        timeout=connection_timeout) as response:
+                    if response.status == 304:
+                        response.read()
+                        os.unlink(f.name)
+                        return False
+                    #end if
+
+                    content_digest = hashlib.sha256()
+
+                    for chunk in self._read_response(response, digest=digest):
+                        content_digest.update(chunk)
+                        f.write(chunk)
+                    #end for
+
+                    validators = {
+                        "ETag":
+                            response.getheader("ETag", ""),
+                        "Last-Modified":
+                            response.getheader("Last-Modified", ""),
+                    }
+                #end with
+
+                if validators["ETag"] or validators["Last-Modified"]:
+                    tag = self._tag_from_validators(validators)
+                else:
+                    tag = content_digest.hexdigest()[:16]
+
+                if tag == old_tag and old_blob_ok:
+                    os.unlink(f.name)
+                    self._store_validators(directory, tag, validators)
+                    return False
                 #end if
 
-                for chunk in iter(lambda: response.read(8192), b""):
-                    bytes_read += len(chunk)
+                if permissions is not None:
+                    os.fchmod(f.fileno(), permissions)
 
-                    if digest is not None:
-                        digest.update(chunk)
-                    yield chunk
+                blob_file = os.path.join(directory, tag)
 
-                    if progress_bar:
-                        progress_bar(bytes_read)
-                #end for
-            #end with
+                os.rename(f.name, blob_file)
+                self._store_validators(directory, tag, validators)
+                os.symlink(tag, f.name)
+                os.rename(f.name, symlink)
+            except Exception as e:
+                if os.path.exists(f.name) or os.path.islink(f.name):
+                    os.unlink(f.name)
+                raise DownloadError(
+                    'error retrieving "{}": {}'.format(url, str(e))
+                )
+            #end try
+        #end with
+
+        if old_tag and old_tag != tag:
+            for filename in [old_tag, self._validators_file(old_tag)]:
+                try:
+                    os.unlink(os.path.join(directory, filename))
+                except OSError:
+                    pass
+            #end for
+        #end if
+
+        return True
+    #end function
+
+    def download_file(self, url, target, sha256sum=None, segments=1,
+            connection_timeout=30, permissions=None):
+        """
+        Downloads url to target by way of target.partial. If an earlier
+        attempt was interrupted, the download resumes where it stopped. With
+        segments > 1, large files are fetched over several connections in
+        parallel. If sha256sum is given, the file is verified before it is
+        moved into place. Returns the hex SHA-256 digest of the file.
+        """
+        partial_file = target + ".partial"
+        state_file   = partial_file + ".segments"
+        state        = None
+
+        partial_dir, partial_tag = os.path.split(os.path.abspath(partial_file))
+        validators_file = os.path.join(
+            partial_dir, self._validators_file(partial_tag)
+        )
+
+        try:
+            if segments > 1:
+                state = self._load_segment_state(state_file, url)
+
+                if state is None and not os.path.exists(partial_file):
+                    state = self._plan_segments(
+                        url, segments, connection_timeout
+                    )
+            #end if
+
+            if state:
+                self._download_segmented(
+                    url, partial_file, state_file, state, connection_timeout
+                )
+                digest = self._file_sha256(partial_file)[0]
+            else:
+                digest = self._download_resumable(
+                    url, partial_file, connection_timeout, sha256sum=sha256sum
+                )
+            #end if
+        except DownloadError:
+            raise
         except Exception as e:
             raise DownloadError(
                 'error retrieving "{}": {}'.format(url, str(e))
             )
+        #end try
+
+        if sha256sum and sha256sum != digest:
+            for filename in [partial_file, state_file, validators_file]:
+                try:
+                    os.unlink(filename)
+                except OSError:
+                    pass
+            #end for
+
+            raise BoltError("file {} has invalid checksum!".format(target))
+        #end if
+
+        if permissions is not None:
+            os.chmod(partial_file, permissions)
+
+        os.replace(partial_file, target)
+
+        for filename in [state_file, validators_file]:
+            try:
+                os.unlink(filename)
+            except OSError:
+                pass
+        #end for
+
+        return digest
     #end function
 
     def source_changed(self, url, old_tag, connection_timeout=30):
@@ -123,9 +488,9 @@ class Downloader:
             string.digits
 
         try:
-            request = urllib.request.Request(url, method="HEAD")
-            with urllib.request.urlopen(request, timeout=connection_timeout)\
-                    as response:
+            with self._pool.open(url, method="HEAD",
+                    timeout=connection_timeout) as response:
+                response.read()
                 identifier1 = response.getheader("ETag", "")
                 identifier2 = response.getheader(
                     "Last-Modified",
@@ -136,11 +501,325 @@ class Downloader:
                 "error generating etag for '{}': {}".format(url, str(e))
             )
 
-        sha256 = hashlib.sha256()
-        sha256.update(identifier1.encode("utf-8"))
-        sha256.update(identifier2.encode("utf-8"))
+        return self._tag_from_validators(
+            {"ETag": identifier1, "Last-Modified": identifier2}
+        )
+    #end function
+
+    # PRIVATE
+
+    def _download_resumable(self, url, partial_file, connection_timeout,
+            sha256sum=None):
+        """
+        Continues partial_file if the server's copy is provably the one it
+        was started from. The ETag or Last-Modified value of the response
+        that started the file is kept in a validators file next to it and
+        sent as If-Range, so a changed file comes back in full.
+        """
+        directory, tag = os.path.split(os.path.abspath(partial_file))
+
+        digest   = hashlib.sha256()
+        offset   = 0
+        if_range = None
+
+        if os.path.exists(partial_file):
+            if_range = self._if_range(self._load_validators(directory, tag))
+
+            # Without a validator there is no telling what the partial file
+            # belongs to, start over.
+            if if_range:
+                offset = self._file_sha256(partial_file, digest=digest)[1]
+        #end if
+
+        headers = {}
+
+        if offset:
+            headers["Range"]    = "bytes={}-".format(offset)
+            headers["If-Range"] = if_range
+        #end if
+
+        try:
+            with self._pool.open(url, headers=headers,
+                    timeout=connection_timeout) as response:
+                if response.status == 206:
+                    f = open(partial_file, "ab")
+                else:
+                    digest = hashlib.sha256()
+                    f = open(partial_file, "wb")
+                    self._store_validators(directory, tag, {
+                        k: response.getheader(k)
+                            for k in ["ETag", "Last-Modified"]
+                                if response.getheader(k)
+                    })
+                #end if
+
+                with f:
+                    for chunk in self._read_response(response, digest=digest):
+                        f.write(chunk)
+                #end with
+            #end with
+        except HTTPError as e:
+            if not (offset and e.status == 416):
+                raise
+
+            # The validator matched, so the range lies beyond the end of the
+            # server's copy. If the partial file is exactly that copy, it is
+            # already complete.
+            content_range = e.headers.get("Content-Range", "")
+            remote_size   = content_range.rpartition("/")[2].strip()
+
+            if (remote_size.isdigit() and int(remote_size) == offset) or \
+                    (sha256sum and sha256sum == digest.hexdigest()):
+                return digest.hexdigest()
+            #end if
+
+            os.unlink(partial_file)
+            return self._download_resumable(
+                url, partial_file, connection_timeout, sha256sum=sha256sum
+            )
+        #end try
+
+        return digest.hexdigest()
+    #end function
+
+    def _plan_segments(self, url, segments, connection_timeout):
+        # Planning is an optimization. If the server (or a presigned
+        # redirect target) does not answer HEAD, use a single GET.
+        try:
+            with self._pool.open(url, method="HEAD",
+                    timeout=connection_timeout) as response:
+                response.read()
+                accept_ranges = response.getheader("Accept-Ranges", "")
+                size = int(response.getheader("Content-Length", "0") or 0)
+                validators = {
+                    k: response.getheader(k)
+                        for k in ["ETag", "Last-Modified"]
+                            if response.getheader(k)
+                }
+            #end with
+        except (DownloadError, OSError, ValueError,
+                http.client.HTTPException):
+            return None
+        #end try
+
+        if accept_ranges.strip().lower() != "bytes":
+            return None
+
+        # Segments may be resumed later, which is only safe if the server's
+        # copy can be identified.
+        if not self._if_range(validators):
+            return None
+
+        segments = min(segments, size // self.MIN_SEGMENT_SIZE)
+        if segments < 2:
+            return None
+
+        segment_size = (size + segments - 1) // segments
+
+        return {
+            "url": url,
+            "size": size,
+            "validators": validators,
+            "segments": [
+                [start, min(start + segment_size, size), 0]
+                for start in range(0, size, segment_size)
+            ]
+        }
+    #end function
+
+    def _download_segmented(self, url, partial_file, state_file, state,
+            connection_timeout):
+        size     = state["size"]
+        segments = state["segments"]
+        if_range = self._if_range(state.get("validators", {}))
+        lock     = threading.Lock()
+        changed  = False
+
+        progress_bar = None
+        if self._progress_bar_class:
+            progress_bar = self._progress_bar_class(size)
+
+        # Recorded progress refers to data in the partial file. If that file
+        # is gone or does not have the planned size, the ranges marked done
+        # cannot be trusted.
+        try:
+            resumable = os.stat(partial_file).st_size == size
+        except OSError:
+            resumable = False
+
+        if not resumable:
+            for segment in segments:
+                segment[2] = 0
+        #end if
+
+        with open(partial_file, "ab"):
+            pass
+        os.truncate(partial_file, size)
 
+        # Progress is only ever recorded after the data has been written, so
+        # a stale state file leads to refetching, never to holes.
+        self._store_segment_state(state_file, state)
+
+        def fetch_segment(segment):
+            start, end, done = segment
+
+            if start + done >= end:
+                return
+
+            nonlocal changed
+
+            headers = {"Range": "bytes={}-{}".format(start + done, end - 1)}
+            if if_range:
+                headers["If-Range"] = if_range
+
+            with self._pool.open(url, headers=headers,
+                    timeout=connection_timeout) as response:
+                if response.status != 206:
+                    changed = True
+                    raise DownloadError(
+                        "remote file changed or server does not honor "
+                        "range requests."
+                    )
+                #end if
+
+                for chunk in iter(lambda: response.read(64 * 1024), b""):
+                    chunk = chunk[:end - start - segment[2]]
+                    os.pwrite(fd, chunk, start + segment[2])
+
+                    with lock:
+                        segment[2] += len(chunk)
+                        if progress_bar:
+                            progress_bar(sum(s[2] for s in segments))
+                    #end with
+                #end for
+            #end with
+        #end inline function
+
+        fd = os.open(partial_file, os.O_WRONLY)
+        try:
+            with ThreadPoolExecutor(max_workers=len(segments)) as executor:
+                futures = [
+                    executor.submit(fetch_segment, segment)
+                        for segment in segments
+                ]
+
+                for future in futures:
+                    future.result()
+            #end with
+        finally:
+            os.close(fd)
+
+            # Without the state file the next attempt starts from scratch.
+            if changed:
+                try:
+                    os.unlink(state_file)
+                except OSError:
+                    pass
+            else:
+                self._store_segment_state(state_file, state)
+            #end if
+        #end try
+
+        for start, end, done in segments:
+            if start + done != end:
+                raise DownloadError(
+                    "segment {}-{} is incomplete.".format(start, end)
+                )
+        #end for
+    #end function
+
+    def _load_segment_state(self, state_file, url):
+        try:
+            with open(state_file, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if state.get("url") != url:
+            return None
+
+        return state
+    #end function
+
+    def _store_segment_state(self, state_file, state):
+        with tempfile.NamedTemporaryFile(mode="w", encoding="utf-8",
+                prefix=".download-", dir=os.path.dirname(state_file),
+                delete=False) as f:
+            json.dump(state, f)
+        os.rename(f.name, state_file)
+    #end function
+
+    def _file_sha256(self, filename, digest=None):
+        digest = digest or hashlib.sha256()
+        size   = 0
+
+        with open(filename, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+                size += len(chunk)
+        #end with
+
+        return digest.hexdigest(), size
+    #end function
+
+    def _read_response(self, response, digest=None):
+        progress_bar = None
+        bytes_read   = 0
+
+        if self._progress_bar_class and response.length:
+            progress_bar = self._progress_bar_class(response.length)
+            progress_bar(0)
+        #end if
+
+        for chunk in iter(lambda: response.read(8192), b""):
+            bytes_read += len(chunk)
+
+            if digest is not None:
+                digest.update(chunk)
+            yield chunk
+
+            if progress_bar:
+                progress_bar(bytes_read)
+        #end for
+    #end function
+
+    def _tag_from_validators(self, validators):
+        sha256 = hashlib.sha256()
+        sha256.update(validators.get("ETag", "").encode("utf-8"))
+        sha256.update(validators.get("Last-Modified", "").encode("utf-8"))
         return sha256.hexdigest()[:16]
     #end function
 
+    def _if_range(self, validators):
+        # Weak ETags must not be used with If-Range.
+        etag = validators.get("ETag", "")
+        if etag and not etag.startswith("W/"):
+            return etag
+        return validators.get("Last-Modified")
+    #end function
+
+    def _validators_file(self, tag):
+        return ".{}.validators".format(tag)
+
+    def _load_validators(self, directory, tag):
+        if not tag:
+            return {}
+
+        try:
+            with open(os.path.join(directory, self._validators_file(tag)),
+                    "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+    #end function
+
+    def _store_validators(self, directory, tag, validators):
+        filename = os.path.join(directory, self._validators_file(tag))
+
+        with tempfile.NamedTemporaryFile(mode="w", encoding="utf-8",
+                prefix=".download-", dir=directory, delete=False) as f:
+            json.dump(validators, f)
+        os.rename(f.name, filename)
+    #end function
+
 #end class
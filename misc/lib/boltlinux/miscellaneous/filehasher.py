@@ -0,0 +1,209 @@
+# -*- encoding: utf-8 -*-
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2021 Tobias Koch <tobias.koch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+import hashlib
+import mmap
+import os
+import sqlite3
+import threading
+import time
+
+from boltlinux.miscellaneous.userinfo import UserInfo
+
+class FileHasher:
+    """
+    Computes SHA-256 sums of files and remembers them keyed by device, inode,
+    size and modification time, so that an unchanged file is only ever hashed
+    once. The memo is kept in a small sqlite database in the user's cache
+    directory and shared between processes.
+    """
+
+    MEMO_FILE     = "file-digests.db"
+    MEMO_MAX_AGE  = 90 * 24 * 3600
+    MMAP_MIN_SIZE = 1024 * 1024
+    BLOCK_SIZE    = 1024 * 1024
+
+    _instance      = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, memo_file=None):
+        self._memo_file = memo_file
+        self._memo      = {}
+        self._conn      = None
+        self._pid       = None
+        self._lock      = threading.Lock()
+    #end function
+
+    @classmethod
+    def instance(klass):
+        with klass._instance_lock:
+            if not klass._instance:
+                cache_dir = UserInfo.cache_dir()
+                memo_file = os.path.join(cache_dir, klass.MEMO_FILE) \
+                    if cache_dir else None
+                klass._instance = klass(memo_file)
+            #end if
+        #end with
+
+        return klass._instance
+    #end function
+
+    @staticmethod
+    def stat_key(st):
+        return "{}:{}:{}:{}".format(
+            st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns
+        )
+    #end function
+
+    def sha256(self, filename, memoize=True):
+        return self.sha256_and_size(filename, memoize=memoize)[0]
+
+    def sha256_and_size(self, filename, memoize=True):
+        with open(filename, "rb") as f:
+            st  = os.fstat(f.fileno())
+            key = self.stat_key(st)
+
+            if memoize:
+                sha256sum = self._lookup(key)
+                if sha256sum:
+                    return sha256sum, st.st_size
+            #end if
+
+            sha256sum = self._hash_file(f, st.st_size)
+        #end with
+
+        if memoize:
+            self._remember(key, sha256sum)
+
+        return sha256sum, st.st_size
+    #end function
+
+    def remember(self, filename, sha256sum):
+        """
+        Records a digest that the caller computed by other means, e.g. while
+        downloading the file.
+        """
+        self._remember(self.stat_key(os.stat(filename)), sha256sum)
+
+    # PRIVATE
+
+    def _hash_file(self, f, size):
+        digest = hashlib.sha256()
+
+        # Hashing a mapping happens in a single call without holding the GIL.
+        if size >= self.MMAP_MIN_SIZE:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                digest.update(m)
+        else:
+            for chunk in iter(lambda: f.read(self.BLOCK_SIZE), b""):
+                digest.update(chunk)
+        #end if
+
+        return digest.hexdigest()
+    #end function
+
+    def _lookup(self, key):
+        with self._lock:
+            sha256sum = self._memo.get(key)
+            if sha256sum:
+                return sha256sum
+
+            conn = self._connection()
+            if not conn:
+                return None
+
+            try:
+                row = conn.execute(
+                    "SELECT sha256 FROM digests WHERE key = ?", (key,)
+                ).fetchone()
+            except sqlite3.Error:
+                return None
+
+            if row:
+                self._memo[key] = row[0]
+                return row[0]
+        #end with
+
+        return None
+    #end function
+
+    def _remember(self, key, sha256sum):
+        with self._lock:
+            self._memo[key] = sha256sum
+
+            conn = self._connection()
+            if not conn:
+                return
+
+            try:
+                with conn:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO digests VALUES (?, ?, ?)",
+                        (key, sha256sum, int(time.time()))
+                    )
+            except sqlite3.Error:
+                pass
+        #end with
+    #end function
+
+    def _connection(self):
+        if not self._memo_file:
+            return None
+
+        # Connections must not be shared with forked children.
+        if self._conn and self._pid == os.getpid():
+            return self._conn
+
+        self._conn = None
+        self._pid  = os.getpid()
+
+        try:
+            os.makedirs(os.path.dirname(self._memo_file), exist_ok=True)
+
+            conn = sqlite3.connect(
+                self._memo_file, timeout=10, check_same_thread=False
+            )
+
+            with conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS digests "
+                    "(key TEXT PRIMARY KEY, sha256 TEXT, created INTEGER)"
+                )
+                conn.execute(
+                    "DELETE FROM digests WHERE created < ?",
+                    (int(time.time()) - self.MEMO_MAX_AGE,)
+                )
+            #end with
+        except (OSError, sqlite3.Error):
+            # Run without a persistent memo.
+            self._memo_file = None
+            return None
+        #end try
+
+        self._conn = conn
+        return conn
+    #end function
+
+#end class
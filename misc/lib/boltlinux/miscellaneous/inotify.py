@@ -0,0 +1,186 @@
+# -*- encoding: utf-8 -*-
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2021 Tobias Koch <tobias.koch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+import ctypes
+import errno
+import os
+import select
+import struct
+
+from ctypes.util import find_library
+
+from boltlinux.error import BoltError
+
+libc = ctypes.CDLL(find_library("c"), use_errno=True)
+
+libc.inotify_init1.argtypes = [ctypes.c_int]
+libc.inotify_init1.restype = ctypes.c_int
+libc.inotify_add_watch.argtypes = \
+    [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+libc.inotify_add_watch.restype = ctypes.c_int
+libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+libc.inotify_rm_watch.restype = ctypes.c_int
+
+class InotifyError(BoltError):
+    pass
+
+class Inotify:
+
+    IN_MODIFY      = 0x00000002
+    IN_ATTRIB      = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM  = 0x00000040
+    IN_MOVED_TO    = 0x00000080
+    IN_CREATE      = 0x00000100
+    IN_DELETE      = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF   = 0x00000800
+    IN_Q_OVERFLOW  = 0x00004000
+    IN_IGNORED     = 0x00008000
+    IN_ONLYDIR     = 0x01000000
+    IN_ISDIR       = 0x40000000
+
+    IN_NONBLOCK = os.O_NONBLOCK
+    IN_CLOEXEC  = os.O_CLOEXEC
+
+    EVENT_HEADER = struct.Struct("iIII")
+
+    class Event:
+
+        def __init__(self, path, mask, cookie, name):
+            self.path   = path
+            self.mask   = mask
+            self.cookie = cookie
+            self.name   = name
+        #end function
+
+        @property
+        def pathname(self):
+            if not self.name:
+                return self.path
+            return os.path.join(self.path, self.name)
+        #end function
+
+        @property
+        def is_dir(self):
+            return bool(self.mask & Inotify.IN_ISDIR)
+
+    #end class
+
+    def __init__(self):
+        self._fd = libc.inotify_init1(Inotify.IN_NONBLOCK | Inotify.IN_CLOEXEC)
+
+        if self._fd < 0:
+            raise InotifyError(
+                "inotify_init1 failed: {}"
+                .format(os.strerror(ctypes.get_errno()))
+            )
+        #end if
+
+        self._watches = {}
+    #end function
+
+    def __del__(self):
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def fileno(self):
+        return self._fd
+
+    def close(self):
+        if self._fd is not None and self._fd >= 0:
+            os.close(self._fd)
+            self._fd = None
+        #end if
+    #end function
+
+    def add_watch(self, path, mask):
+        wd = libc.inotify_add_watch(self._fd, os.fsencode(path), mask)
+
+        if wd < 0:
+            raise InotifyError(
+                "failed to watch '{}': {}"
+                .format(path, os.strerror(ctypes.get_errno()))
+            )
+        #end if
+
+        self._watches[wd] = path
+        return wd
+    #end function
+
+    def rm_watch(self, wd):
+        if self._watches.pop(wd, None) is not None:
+            libc.inotify_rm_watch(self._fd, wd)
+
+    def read_events(self, timeout=None):
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return []
+
+        try:
+            buf = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        except OSError as e:
+            if e.errno == errno.EINTR:
+                return []
+            raise
+        #end try
+
+        events = []
+        offset = 0
+
+        while offset + Inotify.EVENT_HEADER.size <= len(buf):
+            wd, mask, cookie, length = \
+                Inotify.EVENT_HEADER.unpack_from(buf, offset)
+            offset += Inotify.EVENT_HEADER.size
+
+            name = buf[offset:offset + length].rstrip(b"\0")
+            offset += length
+
+            if mask & Inotify.IN_IGNORED:
+                self._watches.pop(wd, None)
+                continue
+            #end if
+
+            events.append(
+                Inotify.Event(
+                    self._watches.get(wd, ""),
+                    mask,
+                    cookie,
+                    os.fsdecode(name)
+                )
+            )
+        #end while
+
+        return events
+    #end function
+
+#end class
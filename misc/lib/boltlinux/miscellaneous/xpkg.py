@@ -84,11 +84,23 @@ class BaseXpkg:
             #end if
         #end for
 
+        self._file_index_map   = None
+        self._file_index_mtime = None
     #end function
 
     def installed_version_of_package(self, package_name):
         return self.packages.get(package_name, None)
 
+    def which_package_provides(self, filename):
+        abspath    = os.path.abspath(filename)
+        file_index = self._file_index()
+
+        if file_index is None:
+            return self._search_package_db(abspath)
+
+        return file_index.get(abspath)
+    #end function
+
     @classmethod
     def compare_versions(cls, a, b):
         m = re.match(r"^(?:(\d+):)?([-+:~.a-zA-Z0-9]+?)(?:-([^-]+))?$", a)
@@ -198,17 +210,67 @@ class BaseXpkg:
         return False
     #end function
 
+    # PRIVATE
+
+    def _file_index(self):
+        """
+        Maps every file listed in the package manager's *.list files to the
+        package that owns it. The index is rebuilt whenever the status file
+        changes. Returns None if the lists cannot be read.
+        """
+        try:
+            mtime = os.stat(self.STATUS_FILE).st_mtime_ns
+        except OSError:
+            return None
+
+        if self._file_index_mtime == mtime:
+            return self._file_index_map
+
+        try:
+            entries = os.listdir(self.INFO_DIR)
+        except OSError:
+            return None
+
+        file_index = {}
+
+        for entry in entries:
+            if not entry.endswith(".list"):
+                continue
+
+            # Strip the multi-arch qualifier, e.g. "libc6:amd64.list".
+            pkg_name  = entry[:-5].split(":", 1)[0]
+            list_file = os.path.join(self.INFO_DIR, entry)
+
+            try:
+                with open(list_file, "r", encoding="utf-8",
+                        errors="surrogateescape") as fp:
+                    for line in fp:
+                        path = line.rstrip("\n").split("\t", 1)[0]
+                        if path:
+                            file_index.setdefault(path, pkg_name)
+                    #end for
+                #end with
+            except OSError:
+                continue
+        #end for
+
+        self._file_index_map   = file_index
+        self._file_index_mtime = mtime
+
+        return file_index
+    #end function
+
 #end class
 
 class Dpkg(BaseXpkg):
     STATUS_FILE = '/var/lib/dpkg/status'
+    INFO_DIR    = '/var/lib/dpkg/info'
 
     def __init__(self):
         super().__init__()
 
-    def which_package_provides(self, filename):
-        abspath = os.path.abspath(filename)
-        cmd     = ["dpkg", "-S", abspath]
+    def main_architecture(self):
+        cmd = ["dpkg", "--print-architecture"]
 
         try:
             procinfo = subprocess.run(cmd, stdout=subprocess.PIPE,
@@ -218,12 +280,13 @@ class Dpkg(BaseXpkg):
 
         return procinfo.stdout\
             .decode(self.preferred_encoding)\
-            .strip()\
-            .split(":", 1)[0]
+            .strip()
     #end function
 
-    def main_architecture(self):
-        cmd = ["dpkg", "--print-architecture"]
+    # PRIVATE
+
+    def _search_package_db(self, abspath):
+        cmd = ["dpkg", "-S", abspath]
 
         try:
             procinfo = subprocess.run(cmd, stdout=subprocess.PIPE,
@@ -233,33 +296,19 @@ class Dpkg(BaseXpkg):
 
         return procinfo.stdout\
             .decode(self.preferred_encoding)\
-            .strip()
+            .strip()\
+            .split(":", 1)[0]
     #end function
 
 #end class
 
 class Opkg(BaseXpkg):
     STATUS_FILE = '/var/lib/opkg/status'
+    INFO_DIR    = '/var/lib/opkg/info'
 
     def __init__(self):
         super().__init__()
 
-    def which_package_provides(self, filename):
-        abspath = os.path.abspath(filename)
-        cmd     = ["opkg", "search", abspath]
-
-        try:
-            procinfo = subprocess.run(cmd, stdout=subprocess.PIPE,
-                    stderr=subprocess.DEVNULL, check=True)
-        except subprocess.CalledProcessError:
-            return None
-
-        return procinfo.stdout\
-            .decode(self.preferred_encoding)\
-            .strip()\
-            .split(" - ", 1)[0]
-    #end function
-
     def main_architecture(self):
         cmd = ["opkg", "print-architecture"]
 
@@ -286,4 +335,21 @@ class Opkg(BaseXpkg):
             return None
     #end function
 
+    # PRIVATE
+
+    def _search_package_db(self, abspath):
+        cmd = ["opkg", "search", abspath]
+
+        try:
+            procinfo = subprocess.run(cmd, stdout=subprocess.PIPE,
+                    stderr=subprocess.DEVNULL, check=True)
+        except subprocess.CalledProcessError:
+            return None
+
+        return procinfo.stdout\
+            .decode(self.preferred_encoding)\
+            .strip()\
+            .split(" - ", 1)[0]
+    #end function
+
 #end class
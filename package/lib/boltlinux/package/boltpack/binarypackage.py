@@ -28,15 +28,19 @@ import os
 import re
 import stat
 import subprocess
+import tempfile
 import textwrap
+import threading
 
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from lxml import etree
 from pathlib import Path
 
 from boltlinux.error import UnmetDependency, PackagingError
 
 from boltlinux.package.boltpack.basepackage import BasePackage
+from boltlinux.package.boltpack.elffile import ElfFile
 from boltlinux.package.boltpack.packagedesc import PackageDescription
 from boltlinux.package.boltpack.filestats import FileStats
 
@@ -47,6 +51,13 @@ from boltlinux.miscellaneous.switch import switch
 
 class BinaryPackage(BasePackage):
 
+    # Limits the number of concurrent objcopy/chrpath chains, also when
+    # several packages are stripped at the same time.
+    _strip_slots = threading.BoundedSemaphore(os.cpu_count() or 1)
+
+    # Guards hardlink maps shared between packages stripped concurrently.
+    _hardlinks_lock = threading.Lock()
+
     class EntryAttributes:
 
         def __init__(self, spec={}):
@@ -101,6 +112,8 @@ class BinaryPackage(BasePackage):
 
         self.section = \
             bin_node.get("section", "unknown")
+        self.compression = \
+            kwargs.get("compression") or bin_node.get("compression", "gz")
         self.source = \
             bin_node.get("source")
         self.architecture = \
@@ -114,6 +127,7 @@ class BinaryPackage(BasePackage):
             kwargs.get("host_type", Platform.target_type())
 
         self.relations = {}
+        self.foreign_hardlinks = []
 
         for dep_type in ["requires", "provides", "conflicts", "replaces"]:
             dep_node = bin_node.find(dep_type)
@@ -397,14 +411,23 @@ class BinaryPackage(BasePackage):
         return self.contents
     #end function
 
-    def strip_debug_symbols_and_unarm_rpath(self):
+    def strip_debug_symbols_and_unarm_rpath(self, hardlinks=None):
+        """
+        Passing the same hardlinks dict to several packages makes sure that
+        a file hardlinked into more than one of them is only stripped once.
+        The other packages record it in foreign_hardlinks, and must call
+        restat_foreign_hardlinks once all packages have been stripped.
+        """
         objcopy = Platform.find_executable(
             self.host_type + "-objcopy", "objcopy"
         )
 
         chrpath = Platform.find_executable("chrpath")
-        hardlinks = {}
+        hardlinks = hardlinks if hardlinks is not None else {}
         install_prefix = self.install_prefix.lstrip("/")
+        jobs = []
+
+        self.foreign_hardlinks = []
 
         # strip unstripped objects
         for src, attr in self.contents.items():
@@ -415,15 +438,8 @@ class BinaryPackage(BasePackage):
             if attr.stats.machine == "no machine":
                 continue
 
-            dev = attr.stats.device
-            ino = attr.stats.inode
-
-            # no need to strip hardlinked content again
-            if hardlinks.setdefault(dev, {}).get(ino):
-                continue
-
             build_id = attr.stats.build_id
-            src_path = os.path.normpath(os.sep.join([self.basedir, src]))
+            src_path = os.path.abspath(os.sep.join([self.basedir, src]))
 
             if build_id:
                 pkg_path = os.sep + os.path.join(
@@ -435,9 +451,23 @@ class BinaryPackage(BasePackage):
                     install_prefix, "lib", "debug", src + ".debug"
                 ]))
 
-            dbg_path = os.path.normpath(os.sep.join([self.basedir, pkg_path]))
+            dbg_path = os.path.abspath(os.sep.join([self.basedir, pkg_path]))
+
+            key   = (attr.stats.device, attr.stats.inode)
+            entry = (self, pkg_path)
+
+            with BinaryPackage._hardlinks_lock:
+                claimed = hardlinks.setdefault(key, entry)
+
+            # no need to strip hardlinked content again
+            if claimed is not entry:
+                owner, owner_pkg_path = claimed
+                if owner is not self:
+                    attr.dbg_info = owner_pkg_path
+                    self.foreign_hardlinks.append((attr, src_path))
+                continue
+            #end if
 
-            hardlinks[dev][ino] = 1
             attr.dbg_info = pkg_path
 
             os.makedirs(os.path.dirname(dbg_path), exist_ok=True)
@@ -464,27 +494,52 @@ class BinaryPackage(BasePackage):
                     (["mv", dbg_file, dbg_path], True),
                 ]
 
-            for cmd, check_retval in cmd_list:
-                subprocess.run(cmd, stderr=subprocess.STDOUT,
-                        check=check_retval)
+            jobs.append((src, attr, src_path, cmd_list))
+        #end for
 
-            subprocess.run(
-                [chrpath, "-c", src_path ],
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL,
-                check=False
+        if not jobs:
+            return
+
+        # The command chains of different files are independent, so run them
+        # side by side. Results are evaluated in content order, so that the
+        # reported errors do not depend on scheduling.
+        max_workers = min(len(jobs), os.cpu_count() or 1)
+        errors = []
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(
+                    self._run_strip_commands, cmd_list, chrpath, src_path
+                )
+                for _, _, src_path, cmd_list in jobs
+            ]
+
+            for (src, attr, src_path, _), future in zip(jobs, futures):
+                try:
+                    future.result()
+                except (OSError, subprocess.CalledProcessError) as e:
+                    errors.append("{}: {}".format(src, str(e)))
+                    continue
+                #end try
+
+                # file size has changed
+                attr.stats.restat(src_path)
+            #end for
+        #end with
+
+        if errors:
+            raise PackagingError(
+                "error stripping debug symbols:\n" + "\n".join(errors)
             )
+        #end if
+    #end function
 
-            # file size has changed
+    def restat_foreign_hardlinks(self):
+        for attr, src_path in self.foreign_hardlinks:
             attr.stats.restat(src_path)
-        #end for
     #end function
 
     def shlib_deps(self, shlib_cache, bin_pkgs):
-        objdump = Platform.find_executable(
-            self.host_type + "-objdump", "objdump"
-        )
-
         for src, attr in self.contents.items():
             fallback = None
 
@@ -505,25 +560,19 @@ class BinaryPackage(BasePackage):
             if not attr.stats.is_file or not attr.stats.is_elf_binary:
                 continue
 
-            abs_path  = os.path.normpath(self.basedir + os.sep + src)
-            word_size = attr.stats.arch_word_size
-            cmd       = [objdump, "-p", abs_path]
+            abs_path = os.path.normpath(self.basedir + os.sep + src)
+
+            try:
+                elf_file = ElfFile(abs_path)
+            except ElfFile.Error:
+                continue
 
-            with subprocess.Popen(cmd, stdout=subprocess.PIPE,
-                    stderr=subprocess.STDOUT, universal_newlines=True) as proc:
-                while True:
-                    line = proc.stdout.readline()
-                    if not line:
-                        break
+            word_size = elf_file.arch_word_size
 
-                    m = re.match(r"^\s*NEEDED\s+(\S+)", line)
-                    if not m:
-                        continue
-                    lib_name = m.group(1)
-                    self._find_and_register_dependency(lib_name, shlib_cache,
-                            bin_pkgs, word_size=word_size)
-                #end for
-            #end with
+            for lib_name in elf_file.needed:
+                self._find_and_register_dependency(lib_name, shlib_cache,
+                        bin_pkgs, word_size=word_size)
+            #end for
         #end for
     #end function
 
@@ -582,4 +631,24 @@ class BinaryPackage(BasePackage):
                 "installed or built package." % (self.name, lib_name))
     #end function
 
+    @staticmethod
+    def _run_strip_commands(cmd_list, chrpath, src_path):
+        # Intermediate debug files are created relative to the working
+        # directory, give each job its own so that equally named files from
+        # different directories cannot clash.
+        with BinaryPackage._strip_slots, \
+                tempfile.TemporaryDirectory(prefix="bolt-strip-") as tmpdir:
+            for cmd, check_retval in cmd_list:
+                subprocess.run(cmd, stderr=subprocess.STDOUT, cwd=tmpdir,
+                        check=check_retval)
+
+            subprocess.run(
+                [chrpath, "-c", src_path ],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                check=False
+            )
+        #end with
+    #end function
+
 #end class
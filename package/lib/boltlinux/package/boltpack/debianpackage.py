@@ -23,16 +23,18 @@
 # THE SOFTWARE.
 #
 
+import functools
 import os
 import stat
 import time
 
-from tempfile import TemporaryDirectory
 from collections import OrderedDict
 
 import boltlinux.ffi.libarchive as libarchive
 from boltlinux.ffi.libarchive import ArchiveEntry, ArchiveFileWriter
 
+from boltlinux.error import BoltValueError
+
 from boltlinux.package.boltpack.filestats import FileStats
 from boltlinux.package.boltpack.binarypackage import BinaryPackage
 from boltlinux.package.boltpack.debianpackagemetadata import \
@@ -40,14 +42,75 @@ from boltlinux.package.boltpack.debianpackagemetadata import \
 
 class DebianPackage(BinaryPackage):
 
+    COMPRESSION_FORMATS = {
+        "gz":   (".gz",  libarchive.COMPRESSION_GZIP, "gzip"),
+        "xz":   (".xz",  libarchive.COMPRESSION_XZ,   "xz"),
+        "zstd": (".zst", libarchive.COMPRESSION_ZSTD, "zstd"),
+    }
+
+    @staticmethod
+    def parse_compression(value):
+        """
+        Parses a compression setting like "gz", "xz:9,threads=0" or
+        "zstd:compression-level=19,long=27". Options are passed on to the
+        libarchive filter as they are, a bare number is the compression
+        level.
+        """
+        fmt, _, option_string = value.partition(":")
+
+        if fmt not in DebianPackage.COMPRESSION_FORMATS:
+            raise BoltValueError(
+                "unsupported compression format '{}'.".format(fmt)
+            )
+        #end if
+
+        filter_name = DebianPackage.COMPRESSION_FORMATS[fmt][2]
+        options = []
+
+        for option in option_string.split(","):
+            option = option.strip()
+            if not option:
+                continue
+
+            key, sep, val = option.partition("=")
+
+            if not sep:
+                if not key.isdigit():
+                    raise BoltValueError(
+                        "invalid compression option '{}'.".format(option)
+                    )
+                key, val = "compression-level", key
+            #end if
+
+            options.append((filter_name, key, val))
+        #end for
+
+        return fmt, options
+    #end function
+
+    def __init__(self, xml_config, **kwargs):
+        super().__init__(xml_config, **kwargs)
+        self._data_compression = self.parse_compression(self.compression)
+    #end function
+
     @property
     def debian_binary_version(self):
         return "2.0"
 
     def do_pack(self):
-        self.pack_package()
+        for task in self.pack_tasks():
+            task()
+    #end function
+
+    def pack_tasks(self):
+        """
+        Returns the independent steps of do_pack as callables, so that the
+        package and its debug package can be written concurrently.
+        """
+        tasks = [self.pack_package]
         if self.make_debug_pkgs:
-            self.pack_package(debug_pkg=True)
+            tasks.append(functools.partial(self.pack_package, debug_pkg=True))
+        return tasks
     #end function
 
     def pkg_filename(self, debug_pkg=False):
@@ -120,53 +183,47 @@ class DebianPackage(BinaryPackage):
     #end function
 
     def assemble_parts(self, meta_data, pkg_contents, pkg_filename):
-        with TemporaryDirectory(prefix="bolt-") as tmpdir:
-            installed_size = self.write_data_part(pkg_contents,
-                    os.path.join(tmpdir, "data.tar.gz"))
-
-            # According to Debian Policy Manual Installed-Size is in KB
-            installed_size = int(installed_size / 1024 + 0.5)
-
-            meta_data["Installed-Size"] = "{}".format(installed_size)
+        # According to Debian Policy Manual Installed-Size is in KB
+        installed_size = int(self.installed_size(pkg_contents) / 1024 + 0.5)
+        meta_data["Installed-Size"] = "{}".format(installed_size)
+
+        debian_binary = (self.debian_binary_version + "\n").encode("utf-8")
+        data_member   = "data.tar" + \
+            self.COMPRESSION_FORMATS[self._data_compression[0]][0]
+
+        # The members are compressed straight into the ar container. Their
+        # sizes are filled into the member headers afterwards.
+        try:
+            with open(pkg_filename, "wb", buffering=0) as fp:
+                fp.write(b"!<arch>\n")
+
+                self._write_ar_member(fp, "debian-binary",
+                        lambda fd: os.write(fd, debian_binary))
+                self._write_ar_member(fp, "control.tar.gz",
+                        lambda fd: self.write_control_part(
+                            meta_data, pkg_contents, fd))
+                self._write_ar_member(fp, data_member,
+                        lambda fd: self.write_data_part(pkg_contents, fd))
+            #end with
+        except BaseException:
+            if os.path.exists(pkg_filename):
+                os.unlink(pkg_filename)
+            raise
+        #end try
+    #end function
 
-            self.write_control_part(meta_data, pkg_contents,
-                    os.path.join(tmpdir, "control.tar.gz"))
+    def installed_size(self, pkg_contents):
+        installed_size = 0
 
-            with open(os.path.join(tmpdir, "debian-binary"), "w+",
-                    encoding="utf-8") as fp:
-                fp.write(self.debian_binary_version + "\n")
-            #end with
+        for src, attr in pkg_contents.items():
+            # imitate behavior of dpkg-gencontrol
+            if attr.stats.is_file or attr.stats.is_symbolic_link:
+                installed_size += attr.stats.st_size
+            else:
+                installed_size += 1024
+        #end for
 
-            with ArchiveFileWriter(pkg_filename, libarchive.FORMAT_AR_SVR4,
-                    libarchive.COMPRESSION_NONE) as archive:
-                with ArchiveEntry() as archive_entry:
-                    for entry_name in ["debian-binary", "control.tar.gz",
-                            "data.tar.gz"]:
-                        archive_entry.clear()
-
-                        full_path = os.path.normpath(os.sep.join([tmpdir,
-                            entry_name]))
-                        archive_entry.copy_stat(full_path)
-                        archive_entry.pathname = entry_name
-                        archive_entry.mode = stat.S_IFREG | 0o644
-                        archive_entry.uid = 0
-                        archive_entry.gid = 0
-                        archive_entry.uname = "root"
-                        archive_entry.gname = "root"
-                        archive.write_entry(archive_entry)
-
-                        with open(full_path, "rb") as fp:
-                            while True:
-                                buf = fp.read(4096)
-                                if not buf:
-                                    break
-                                archive.write_data(buf)
-                            #end while
-                        #end with
-                    #end for
-                #end with
-            #end with
-        #end with
+        return installed_size
     #end function
 
     def write_control_part(self, meta_data, pkg_contents, ctrl_abspath):
@@ -206,10 +263,11 @@ class DebianPackage(BinaryPackage):
     #end function
 
     def write_data_part(self, pkg_contents, data_abspath):
-        installed_size = 0
+        fmt, options = self._data_compression
+        compression  = self.COMPRESSION_FORMATS[fmt][1]
 
         with ArchiveFileWriter(data_abspath, libarchive.FORMAT_TAR_USTAR,
-                libarchive.COMPRESSION_GZIP) as archive:
+                compression, options=options) as archive:
 
             timestamp = int(time.time())
 
@@ -244,26 +302,12 @@ class DebianPackage(BinaryPackage):
                     archive.write_entry(archive_entry)
 
                     if archive_entry.is_file:
-                        with open(real_path, "rb") as fp:
-                            while True:
-                                buf = fp.read(4096)
-                                if not buf:
-                                    break
-                                archive.write_data(buf)
-                            #end while
-                        #end with
-                    #end if
-
-                    # imitate behavior of dpkg-gencontrol
-                    if attr.stats.is_file or attr.stats.is_symbolic_link:
-                        installed_size += attr.stats.st_size
-                    else:
-                        installed_size += 1024
+                        archive.write_file(real_path)
                 #end for
             #end with
         #end with
 
-        return installed_size
+        return self.installed_size(pkg_contents)
     #end function
 
     def meta_data(self, debug_pkg=False):
@@ -325,4 +369,30 @@ class DebianPackage(BinaryPackage):
         return result
     #end function
 
+    # PRIVATE
+
+    def _write_ar_member(self, fp, name, write_func):
+        header_offset = fp.tell()
+        fp.write(self._ar_header(name, 0))
+
+        data_offset = fp.tell()
+        write_func(fp.fileno())
+        size = os.lseek(fp.fileno(), 0, os.SEEK_END) - data_offset
+
+        # ar members are aligned to even offsets
+        if size % 2:
+            fp.write(b"\n")
+
+        fp.seek(header_offset)
+        fp.write(self._ar_header(name, size))
+        fp.seek(0, os.SEEK_END)
+    #end function
+
+    def _ar_header(self, name, size):
+        header = "{:<16}{:<12}{:<6}{:<6}{:<8o}{:<10}`\n".format(
+            name + "/", int(time.time()), 0, 0, stat.S_IFREG | 0o644, size
+        )
+        return header.encode("ascii")
+    #end function
+
 #end class
@@ -0,0 +1,333 @@
+# -*- encoding: utf-8 -*-
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2021 Tobias Koch <tobias.koch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+import mmap
+import os
+import struct
+
+from boltlinux.error import BoltError
+
+class ElfFile:
+    """
+    Minimal reader for the ELF file, program and section headers, the
+    dynamic section and the GNU build-id note. Works for any architecture
+    and byte order, so there is no need for a matching cross objdump.
+    """
+
+    ELFCLASS32 = 1
+    ELFCLASS64 = 2
+
+    ELFDATA2LSB = 1
+    ELFDATA2MSB = 2
+
+    PT_LOAD    = 1
+    PT_DYNAMIC = 2
+    PT_INTERP  = 3
+    PT_NOTE    = 4
+
+    SHT_SYMTAB = 2
+    SHT_NOTE   = 7
+
+    NT_GNU_BUILD_ID = 3
+
+    DT_NULL    = 0
+    DT_NEEDED  = 1
+    DT_STRTAB  = 5
+    DT_SONAME  = 14
+    DT_RPATH   = 15
+    DT_RUNPATH = 29
+
+    ET_REL  = 1
+    ET_EXEC = 2
+    ET_DYN  = 3
+
+    # Machine names as printed by file(1), so that FileStats.machine keeps
+    # returning the same strings it used to extract from libmagic.
+    MACHINE_NAMES = {
+        0:   "no machine",
+        2:   "SPARC",
+        3:   "Intel 80386",
+        8:   "MIPS",
+        20:  "PowerPC or cisco 4500",
+        21:  "64-bit PowerPC or cisco 7500",
+        22:  "IBM S/390",
+        40:  "ARM",
+        43:  "SPARC V9",
+        62:  "x86-64",
+        183: "ARM aarch64",
+        243: "UCB RISC-V",
+        258: "LoongArch",
+    }
+
+    class Error(BoltError):
+        pass
+
+    def __init__(self, filename):
+        self.filename    = filename
+        self.elf_class   = None
+        self.byte_order  = None
+        self.type        = None
+        self.machine     = None
+        self.interpreter = None
+        self.needed      = []
+        self.soname      = None
+        self.rpath       = None
+        self.runpath     = None
+        self.is_dynamic  = False
+        self.has_symtab  = False
+        self.build_id    = None
+
+        try:
+            with open(filename, "rb") as f:
+                if os.fstat(f.fileno()).st_size < 16:
+                    raise ElfFile.Error("file too short.")
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                    self._parse(m)
+            #end with
+        except ElfFile.Error as e:
+            raise ElfFile.Error(
+                "failed to parse ELF file '{}': {}".format(filename, str(e))
+            )
+        except (OSError, ValueError, struct.error) as e:
+            raise ElfFile.Error(
+                "failed to read ELF file '{}': {}".format(filename, str(e))
+            )
+        #end try
+    #end function
+
+    @staticmethod
+    def is_elf(filename):
+        try:
+            with open(filename, "rb") as f:
+                return f.read(4) == b"\x7fELF"
+        except OSError:
+            return False
+    #end function
+
+    @property
+    def arch_word_size(self):
+        # Same representation as FileStats.arch_word_size.
+        return "64" if self.elf_class == self.ELFCLASS64 else "32"
+
+    @property
+    def machine_name(self):
+        return self.MACHINE_NAMES.get(
+            self.machine, "*unknown arch 0x{:x}*".format(self.machine)
+        )
+    #end function
+
+    @property
+    def is_linked(self):
+        return self.type in [self.ET_EXEC, self.ET_DYN]
+
+    @property
+    def is_dynamically_linked(self):
+        return self.is_linked and self.is_dynamic
+
+    @property
+    def is_stripped(self):
+        # Like file(1), only linked objects can be "not stripped".
+        return not (self.is_linked and self.has_symtab)
+
+    # PRIVATE
+
+    def _parse(self, m):
+        if m[:4] != b"\x7fELF":
+            raise ElfFile.Error("not an ELF file.")
+
+        self.elf_class = m[4]
+        data_encoding  = m[5]
+
+        if self.elf_class not in [self.ELFCLASS32, self.ELFCLASS64]:
+            raise ElfFile.Error("invalid ELF class {}.".format(m[4]))
+
+        if data_encoding == self.ELFDATA2LSB:
+            self.byte_order = "<"
+        elif data_encoding == self.ELFDATA2MSB:
+            self.byte_order = ">"
+        else:
+            raise ElfFile.Error(
+                "invalid data encoding {}.".format(data_encoding)
+            )
+        #end if
+
+        bo = self.byte_order
+
+        if self.elf_class == self.ELFCLASS64:
+            ehdr_fmt = bo + "HHIQQQIHHHHHH"
+            phdr_fmt = bo + "IIQQQQQQ"
+            shdr_fmt = bo + "IIQQQQIIQQ"
+            dyn_fmt  = bo + "qQ"
+        else:
+            ehdr_fmt = bo + "HHIIIIIHHHHHH"
+            phdr_fmt = bo + "IIIIIIII"
+            shdr_fmt = bo + "IIIIIIIIII"
+            dyn_fmt  = bo + "iI"
+        #end if
+
+        self.type, \
+        self.machine, \
+        _, \
+        _, \
+        e_phoff, \
+        e_shoff, \
+        _, \
+        _, \
+        e_phentsize, \
+        e_phnum, \
+        e_shentsize, \
+        e_shnum, \
+        _ = struct.unpack_from(ehdr_fmt, m, 16)
+
+        segments = []
+        notes    = []
+        dynamic  = None
+
+        for i in range(e_phnum):
+            fields = struct.unpack_from(phdr_fmt, m, e_phoff + i * e_phentsize)
+
+            if self.elf_class == self.ELFCLASS64:
+                p_type, _, p_offset, p_vaddr, _, p_filesz, _, p_align = \
+                    fields
+            else:
+                p_type, p_offset, p_vaddr, _, p_filesz, _, _, p_align = \
+                    fields
+
+            if p_type == self.PT_LOAD:
+                segments.append((p_vaddr, p_offset, p_filesz))
+            elif p_type == self.PT_DYNAMIC:
+                dynamic = (p_offset, p_filesz)
+            elif p_type == self.PT_INTERP:
+                self.interpreter = self._read_string(m, p_offset)
+            elif p_type == self.PT_NOTE:
+                notes.append((p_offset, p_filesz, p_align))
+        #end for
+
+        if e_shoff and e_shentsize >= struct.calcsize(shdr_fmt):
+            for i in range(e_shnum):
+                fields = struct.unpack_from(
+                    shdr_fmt, m, e_shoff + i * e_shentsize
+                )
+
+                _, sh_type, _, _, sh_offset, sh_size, _, _, sh_addralign, _ = \
+                    fields
+
+                if sh_type == self.SHT_SYMTAB:
+                    self.has_symtab = True
+                elif sh_type == self.SHT_NOTE:
+                    # Relocatable objects have no program headers.
+                    notes.append((sh_offset, sh_size, sh_addralign))
+            #end for
+        #end if
+
+        for offset, size, align in notes:
+            self._parse_notes(m, offset, size, align)
+            if self.build_id:
+                break
+        #end for
+
+        self._segments = segments
+
+        if dynamic:
+            self.is_dynamic = True
+            self._parse_dynamic(m, dynamic[0], dynamic[1], dyn_fmt)
+    #end function
+
+    def _parse_dynamic(self, m, offset, size, dyn_fmt):
+        entry_size = struct.calcsize(dyn_fmt)
+        entries    = []
+        strtab     = None
+
+        for pos in range(offset, min(offset + size, len(m)), entry_size):
+            d_tag, d_val = struct.unpack_from(dyn_fmt, m, pos)
+
+            if d_tag == self.DT_NULL:
+                break
+            if d_tag == self.DT_STRTAB:
+                strtab = self._vaddr_to_offset(d_val)
+            entries.append((d_tag, d_val))
+        #end for
+
+        if strtab is None:
+            return
+
+        for d_tag, d_val in entries:
+            if d_tag == self.DT_NEEDED:
+                self.needed.append(self._read_string(m, strtab + d_val))
+            elif d_tag == self.DT_SONAME:
+                self.soname = self._read_string(m, strtab + d_val)
+            elif d_tag == self.DT_RPATH:
+                self.rpath = self._read_string(m, strtab + d_val)
+            elif d_tag == self.DT_RUNPATH:
+                self.runpath = self._read_string(m, strtab + d_val)
+        #end for
+    #end function
+
+    def _parse_notes(self, m, offset, size, align):
+        bo    = self.byte_order
+        align = 8 if align == 8 else 4
+        end   = min(offset + size, len(m))
+        pos   = offset
+
+        def padded(n):
+            return (n + align - 1) & ~(align - 1)
+
+        while pos + 12 <= end:
+            n_namesz, n_descsz, n_type = struct.unpack_from(bo + "III", m, pos)
+
+            name_start = pos + 12
+            desc_start = name_start + padded(n_namesz)
+            pos        = desc_start + padded(n_descsz)
+
+            if pos > end:
+                break
+
+            if n_type == self.NT_GNU_BUILD_ID and \
+                    m[name_start:name_start + n_namesz] == b"GNU\0":
+                self.build_id = m[desc_start:desc_start + n_descsz].hex()
+                break
+            #end if
+        #end while
+    #end function
+
+    def _vaddr_to_offset(self, vaddr):
+        for p_vaddr, p_offset, p_filesz in self._segments:
+            if p_vaddr <= vaddr < p_vaddr + p_filesz:
+                return vaddr - p_vaddr + p_offset
+        #end for
+
+        raise ElfFile.Error(
+            "address 0x{:x} is not mapped from the file.".format(vaddr)
+        )
+    #end function
+
+    def _read_string(self, m, offset):
+        end = m.find(b"\0", offset)
+        if end == -1:
+            raise ElfFile.Error("unterminated string.")
+        return m[offset:end].decode("utf-8", errors="surrogateescape")
+    #end function
+
+#end class
@@ -27,6 +27,7 @@ import magic
 import os
 import re
 import stat
+import threading
 import time
 
 try:
@@ -34,10 +35,26 @@ try:
 except ImportError:
     from magic.compat import FileMagic
 
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
+
+from boltlinux.package.boltpack.elffile import ElfFile
 
 class FileStats:
 
+    # ELF parse results keyed by (dev, ino, size, mtime_ns). Each file is
+    # looked at several times while building a package, but only parsed once.
+    # File lists are generated in parallel, hence the lock.
+    ELF_CACHE_SIZE = 1024
+
+    _elf_cache = OrderedDict()
+    _elf_cache_lock = threading.Lock()
+
+    @classmethod
+    def clear_elf_cache(cls):
+        with cls._elf_cache_lock:
+            cls._elf_cache.clear()
+    #end function
+
     @staticmethod
     def default_dir_stats():
         magic_obj = {
@@ -98,19 +115,26 @@ class FileStats:
 
     @staticmethod
     def detect_from_filename(filename):
-        if os.path.islink(filename):
+        try:
+            stats_obj = os.lstat(filename)
+        except FileNotFoundError:
+            raise ValueError("no such file '%s'" % filename)
+
+        magic_obj = None
+        elf_file  = False
+
+        if stat.S_ISLNK(stats_obj.st_mode):
             link_target = os.readlink(filename)
             magic_obj = FileMagic(
                     mime_type='inode/symlink', encoding='binary',
                     name='symbolic link to ' + link_target)
-        else:
-            if not os.path.exists(filename):
-                raise ValueError("no such file '%s'" % filename)
-            magic_obj = magic.detect_from_filename(filename)
+        elif stat.S_ISREG(stats_obj.st_mode):
+            elf_file = FileStats._sniff_elf(filename, stats_obj)
         #end if
 
-        stats_obj = os.lstat(filename)
-        filestats = FileStats(magic_obj, stats_obj)
+        filestats = FileStats(
+            magic_obj, stats_obj, filename=filename, elf_file=elf_file
+        )
 
         if filestats.is_symbolic_link:
             filestats.link_target = link_target
@@ -118,9 +142,17 @@ class FileStats:
         return filestats
     #end function
 
-    def __init__(self, magic_obj, stats_obj):
+    def __init__(self, magic_obj, stats_obj, filename=None, elf_file=None):
+        """
+        If `magic_obj` is None, libmagic is run on `filename` on first access
+        to a magic attribute. `elf_file` is an ElfFile for ELF files, False
+        for files known not to be ELF, or None if the ELF properties should
+        be derived from the libmagic description.
+        """
         self._magic_obj = magic_obj
         self._stats_obj = stats_obj
+        self._filename  = filename
+        self._elf_file  = elf_file
         self.link_target = ""
     #end function
 
@@ -148,11 +180,19 @@ class FileStats:
         return self._stats_obj.st_nlink
     #end function
 
+    @property
+    def mime_type(self):
+        return self._magic.mime_type
+    #end function
+
     @property
     def build_id(self):
+        if self._elf_file is not None:
+            return self._elf_file.build_id if self._elf_file else None
+
         regexp_build_id = \
             r"ELF \d+-bit .SB .*, BuildID\[sha1\]=([0-9a-fA-F]+).*"
-        m = re.match(regexp_build_id, self._magic_obj.name)
+        m = re.match(regexp_build_id, self._magic.name)
         if m:
             return m.group(1)
         return None
@@ -160,28 +200,38 @@ class FileStats:
 
     @property
     def is_elf_binary(self):
+        if self._elf_file is not None:
+            return bool(self._elf_file)
+
         regexp = r"ELF \d+-bit .SB .*"
-        if re.match(regexp, self._magic_obj.name):
+        if re.match(regexp, self._magic.name):
             return True
         return False
     #end function
 
     @property
     def is_stripped(self):
+        if self._elf_file is not None:
+            return self._elf_file.is_stripped if self._elf_file else True
+
         regexp = r"ELF \d+-bit .SB .*, .* linked.*, .*not stripped"
-        if re.match(regexp, self._magic_obj.name):
+        if re.match(regexp, self._magic.name):
             return False
         return True
     #end function
 
     @property
     def is_dynamically_linked(self):
+        if self._elf_file is not None:
+            return self._elf_file.is_dynamically_linked \
+                if self._elf_file else False
+
         regexp_bin = \
             r"ELF \d+-bit .SB .*?executable.*, dynamically linked.*"
         regexp_lib = \
             r"ELF \d+-bit .SB .*?shared object.*, dynamically linked.*"
 
-        magic = self._magic_obj.name
+        magic = self._magic.name
         if re.match(regexp_bin, magic) or re.match(regexp_lib, magic):
             return True
 
@@ -190,8 +240,11 @@ class FileStats:
 
     @property
     def machine(self):
+        if self._elf_file is not None:
+            return self._elf_file.machine_name if self._elf_file else None
+
         regexp_machine = r"ELF \d+-bit .SB .*?, ([^,]+), .*"
-        m = re.match(regexp_machine, self._magic_obj.name)
+        m = re.match(regexp_machine, self._magic.name)
         if m:
             return m.group(1)
         return None
@@ -199,8 +252,11 @@ class FileStats:
 
     @property
     def arch_word_size(self):
+        if self._elf_file is not None:
+            return self._elf_file.arch_word_size if self._elf_file else None
+
         regexp_elf = r"ELF (\d+)-bit .SB.*"
-        m = re.match(regexp_elf, self._magic_obj.name)
+        m = re.match(regexp_elf, self._magic.name)
         if m:
             return m.group(1)
         return None
@@ -258,7 +314,53 @@ class FileStats:
         if name in stat_attributes:
             return self._stats_obj.__getattribute__(name)
         else:
-            return self._magic_obj.__getattribute__(name)
+            return self._magic.__getattribute__(name)
+    #end function
+
+    # PRIVATE
+
+    @property
+    def _magic(self):
+        if self._magic_obj is None:
+            self._magic_obj = magic.detect_from_filename(self._filename)
+        return self._magic_obj
+    #end function
+
+    @classmethod
+    def _sniff_elf(cls, filename, stats_obj):
+        """
+        Returns an ElfFile if the file is a readable ELF object, False if it
+        is not ELF and None if it looks like ELF but cannot be parsed.
+        """
+        key = (
+            stats_obj.st_dev,
+            stats_obj.st_ino,
+            stats_obj.st_size,
+            stats_obj.st_mtime_ns
+        )
+
+        with cls._elf_cache_lock:
+            if key in cls._elf_cache:
+                cls._elf_cache.move_to_end(key)
+                return cls._elf_cache[key]
+        #end with
+
+        if not ElfFile.is_elf(filename):
+            result = False
+        else:
+            try:
+                result = ElfFile(filename)
+            except ElfFile.Error:
+                result = None
+        #end if
+
+        with cls._elf_cache_lock:
+            cls._elf_cache[key] = result
+            while len(cls._elf_cache) > cls.ELF_CACHE_SIZE:
+                cls._elf_cache.popitem(last=False)
+        #end with
+
+        return result
     #end function
 
 #end class
@@ -24,11 +24,15 @@
 #
 
 import copy
+import functools
 import logging
 import os
 import shutil
 
-from boltlinux.error import UnmetDependency, InvocationError, SkipBuild
+from concurrent.futures import ThreadPoolExecutor
+
+from boltlinux.error import UnmetDependency, InvocationError, SkipBuild, \
+        BoltValueError
 
 from boltlinux.miscellaneous.platform import Platform
 from boltlinux.miscellaneous.userinfo import UserInfo
@@ -36,6 +40,7 @@ from boltlinux.miscellaneous.userinfo import UserInfo
 from boltlinux.package.boltpack.basepackage import BasePackage
 from boltlinux.package.boltpack.changelog import Changelog
 from boltlinux.package.boltpack.debianpackage import DebianPackage
+from boltlinux.package.boltpack.filestats import FileStats
 from boltlinux.package.boltpack.packagedesc import PackageDescription
 from boltlinux.package.boltpack.shlibcache import ShlibCache
 from boltlinux.package.boltpack.sourcecache import SourceCache
@@ -52,6 +57,8 @@ class PackageControl:
                 Platform.target_machine(),
             "build_for":
                 "target",
+            "compression":
+                None,
             "copy_archives":
                 True,
             "debug_pkgs":
@@ -66,6 +73,8 @@ class PackageControl:
                 False,
             "libc_name":
                 Platform.libc_name(),
+            "max_cache_size":
+                None,
             "outdir":
                 None,
             "tools_arch":
@@ -73,6 +82,13 @@ class PackageControl:
         }
         self.parms.update(kwargs)
 
+        if self.parms["compression"]:
+            try:
+                DebianPackage.parse_compression(self.parms["compression"])
+            except BoltValueError as e:
+                raise InvocationError(str(e))
+        #end if
+
         build_for = self.parms["build_for"]
         pkg_arch  = self.parms["arch"] if build_for == "target" \
                         else self.parms["tools_arch"]
@@ -251,6 +267,7 @@ class PackageControl:
                 pkg = DebianPackage(
                     node,
                     debug_pkgs=self.parms["debug_pkgs"],
+                    compression=self.parms["compression"],
                     install_prefix=self.defines["BOLT_INSTALL_PREFIX"],
                     host_type=self.defines["BOLT_HOST_TYPE"],
                     build_for=build_for
@@ -334,7 +351,8 @@ class PackageControl:
             os.makedirs(directory)
 
         source_cache = SourceCache(self._cache_dir, self.parms["release"],
-                force_local=self.parms["force_local"])
+                force_local=self.parms["force_local"],
+                max_size=self.parms["max_cache_size"])
 
         self.src_pkg \
             .unpack(directory, source_cache=source_cache) \
@@ -367,14 +385,46 @@ class PackageControl:
 
     def package(self):
         shlib_cache = ShlibCache(prefix=self.defines["BOLT_INSTALL_PREFIX"])
-        for pkg in self.bin_pkgs:
-            pkg.prepare()
-        for pkg in self.bin_pkgs:
-            pkg.strip_debug_symbols_and_unarm_rpath()
-        for pkg in self.bin_pkgs:
-            shlib_cache.overlay_package(pkg)
-        for pkg in self.bin_pkgs:
-            pkg.pack(shlib_cache, self.bin_pkgs)
+        max_workers = os.cpu_count() or 1
+
+        # Parsed ELF objects are only shared within one build.
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                # File lists only depend on the package itself.
+                self._run_tasks(executor, [
+                    pkg.prepare for pkg in self.bin_pkgs
+                ])
+
+                # Stripping starts once all file lists are complete. Files that
+                # are hardlinked into several packages are stripped only once.
+                hardlinks = {}
+
+                self._run_tasks(executor, [
+                    functools.partial(
+                        pkg.strip_debug_symbols_and_unarm_rpath, hardlinks
+                    )
+                    for pkg in self.bin_pkgs
+                ])
+
+                for pkg in self.bin_pkgs:
+                    pkg.restat_foreign_hardlinks()
+
+                # The shlib cache has to be complete before dependencies can be
+                # resolved. This is the only point where packages interact.
+                for pkg in self.bin_pkgs:
+                    shlib_cache.overlay_package(pkg)
+                for pkg in self.bin_pkgs:
+                    pkg.shlib_deps(shlib_cache, self.bin_pkgs)
+
+                # Compressing and assembling the packages (and the debug
+                # packages) is independent again.
+                self._run_tasks(executor, [
+                    task for pkg in self.bin_pkgs for task in pkg.pack_tasks()
+                ])
+            #end with
+        finally:
+            FileStats.clear_elf_cache()
+        #end try
     #end function
 
     def repackage(self):
@@ -395,6 +445,21 @@ class PackageControl:
 
     # PRIVATE
 
+    def _run_tasks(self, executor, tasks):
+        futures = [executor.submit(task) for task in tasks]
+
+        # Wait in submission order, so that the error reported does not
+        # depend on scheduling.
+        try:
+            for future in futures:
+                future.result()
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+        #end try
+    #end function
+
     def _missing_build_dependencies(self):
         unfulfilled_dependency_spec = BasePackage.DependencySpecification()
 
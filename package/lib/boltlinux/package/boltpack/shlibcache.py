@@ -29,7 +29,7 @@ import os
 import re
 import subprocess
 
-from boltlinux.package.boltpack.filestats import FileStats
+from boltlinux.package.boltpack.elffile import ElfFile
 
 from boltlinux.miscellaneous.packagemanager import PackageManager
 from boltlinux.miscellaneous.platform import Platform
@@ -74,9 +74,11 @@ class ShlibCache:
 
         def arch_word_size(self):
             if self.word_size is None:
-                self.word_size = FileStats\
-                        .detect_from_filename(os.path.realpath(self.lib_path))\
-                        .arch_word_size
+                try:
+                    self.word_size = ElfFile(os.path.realpath(self.lib_path))\
+                            .arch_word_size
+                except ElfFile.Error:
+                    pass
             return self.word_size
         #end function
 
@@ -161,24 +163,29 @@ class ShlibCache:
             if not re.match(r'^(?:lib|ld|ld64).*?\.so.*$', lib_name):
                 continue
 
+            abs_path = os.path.normpath(
+                    binary_package.basedir + os.sep + src)
+
             if attr.stats.is_symbolic_link:
-                abs_path = os.path.normpath(
-                        binary_package.basedir + os.sep + src)
                 if not os.path.exists(abs_path):
                     continue
-                stats = FileStats.detect_from_filename(
-                        os.path.realpath(abs_path))
-            else:
-                stats = attr.stats
+                abs_path = os.path.realpath(abs_path)
+            elif not attr.stats.is_file:
+                continue
             #end if
 
-            if not stats.is_dynamically_linked:
+            try:
+                elf_file = ElfFile(abs_path)
+            except ElfFile.Error:
+                continue
+
+            if not elf_file.is_dynamic:
                 continue
 
             new_shared_obj             = ShlibCache.SharedObject(src)
             new_shared_obj.pkg_name    = binary_package.name
             new_shared_obj.pkg_version = binary_package.version
-            new_shared_obj.word_size   = stats.arch_word_size
+            new_shared_obj.word_size   = elf_file.arch_word_size
 
             shared_obj_list = self.map.setdefault(lib_name, [])
 
@@ -23,29 +23,54 @@
 # THE SOFTWARE.
 #
 
-import hashlib
 import logging
 import os
+import shutil
+import threading
+import time
 import urllib.request
 
 from boltlinux.distro.config.distroinfo import DistroInfo
-from boltlinux.error import BoltError, NetworkError
-from boltlinux.miscellaneous.progressbar import ProgressBar
+from boltlinux.error import NetworkError
 from boltlinux.miscellaneous.downloader import Downloader, DownloadError
+from boltlinux.miscellaneous.filehasher import FileHasher
+from boltlinux.miscellaneous.progressbar import ProgressBar
 
 LOGGER = logging.getLogger(__name__)
 
 class SourceCache:
+    """
+    Source archives are stored once under bolt/blobs/sha256 keyed by their
+    SHA-256 sum. The per-release paths under bolt/dists are hardlinks (or
+    symlinks, where hardlinks are not possible) to these blobs.
+    """
+
+    DOWNLOAD_SEGMENTS = 4
+
+    VERIFIED_XATTR  = "user.bolt.sha256"
+    VERIFIED_SUFFIX = ".verified"
 
-    def __init__(self, cache_dir, release, verbose=True, force_local=False):
+    def __init__(self, cache_dir, release, verbose=True, force_local=False,
+            max_size=None):
         self.cache_dir   = cache_dir
         self.release     = release
         self.verbose     = verbose
         self.force_local = force_local
+        self.max_size    = max_size
+
+        # Archives may be retrieved from several threads. Blobs handed out
+        # by this instance must survive garbage collection triggered by
+        # another thread, and eviction must not interleave with linking.
+        self._lock   = threading.RLock()
+        self._in_use = set()
     #end function
 
     def find_and_retrieve(self, repo_name, pkg_name, version, filename,
-            upstream_source, sha256sum=None):
+            upstream_source, sha256sum=None, progress=True):
+        """
+        Set progress to False if several archives are retrieved at the same
+        time, otherwise their progress bars garble the terminal.
+        """
         pkg = self.fetch_from_cache(
             repo_name, pkg_name, version, filename, sha256sum
         )
@@ -59,7 +84,8 @@ class SourceCache:
                 pkg_name,
                 version,
                 filename,
-                sha256sum
+                sha256sum,
+                progress=progress
             )
         except DownloadError as e:
             if upstream_source:
@@ -77,7 +103,8 @@ class SourceCache:
                 pkg_name,
                 version,
                 filename,
-                sha256sum
+                sha256sum,
+                progress=progress
             )
         except DownloadError as e:
             LOGGER.error(str(e))
@@ -85,6 +112,23 @@ class SourceCache:
         return pkg
     #end function
 
+    def collect_garbage(self, max_size=None, keep=None):
+        """
+        Evicts the least recently used blobs, together with all paths that
+        refer to them, until the blob store is no larger than max_size bytes.
+        Blobs in keep and blobs handed out by this instance are not evicted.
+        """
+        max_size = max_size if max_size is not None else self.max_size
+
+        if max_size is None:
+            return
+
+        with self._lock:
+            keep = set(keep or []) | self._in_use
+            self._collect_garbage(max_size, keep)
+        #end with
+    #end function
+
     def fetch_from_cache(self, repo_name, pkg_name, version, filename,
             sha256sum=None):
         if len(pkg_name) > 3 and pkg_name.startswith("lib"):
@@ -99,27 +143,39 @@ class SourceCache:
                 "sources", rel_path
         )
 
+        if sha256sum:
+            blob_file = self._blob_path(sha256sum)
+
+            with self._lock:
+                if self._is_verified(blob_file, sha256sum):
+                    self._link_blob(blob_file, abs_path)
+                    self._touch_blob(blob_file)
+                    self._in_use.add(sha256sum)
+                    return abs_path
+                #end if
+            #end with
+        #end if
+
         if not os.path.exists(abs_path):
             return None
         if not sha256sum:
             return abs_path
 
-        h = hashlib.sha256()
-
-        with open(abs_path, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                h.update(chunk)
-        #end with
-
-        if sha256sum == h.hexdigest():
+        # Files cached before the blob store existed are hashed once and
+        # then moved into it.
+        if sha256sum == FileHasher.instance().sha256(abs_path,
+                memoize=False):
+            self._store_blob(abs_path, sha256sum)
             return abs_path
 
         return None
     #end function
 
     def fetch_from_repo(self, repo_name, pkg_name, version, filename,
-            sha256sum=None):
-        downloader = Downloader(progress_bar_class=ProgressBar)
+            sha256sum=None, progress=True):
+        downloader = Downloader(
+            progress_bar_class=ProgressBar if progress else None
+        )
 
         if len(pkg_name) > 3 and pkg_name.startswith("lib"):
             first_letter = pkg_name[3]
@@ -150,29 +206,30 @@ class SourceCache:
             rel_path
         ])
 
-        h = hashlib.sha256()
-
         LOGGER.info("retrieving {}".format(source_url))
         try:
             os.makedirs(os.path.dirname(target_url), exist_ok=True)
 
-            with open(target_url, "wb+") as f:
-                for chunk in downloader.get(source_url, digest=h):
-                    f.write(chunk)
+            digest = downloader.download_file(
+                source_url,
+                target_url,
+                sha256sum=sha256sum,
+                segments=self.DOWNLOAD_SEGMENTS
+            )
         except urllib.error.URLError as e:
             raise NetworkError(
                 "failed to retrieve {}: {}".format(source_url, e.reason)
             )
 
-        if sha256sum and sha256sum != h.hexdigest():
-            raise BoltError("file {} has invalid checksum!".format(target_url))
-
+        self._store_blob(target_url, digest)
         return target_url
     #end function
 
     def fetch_from_upstream(self, upstream_source, repo_name, pkg_name,
-            version, filename, sha256sum=None):
-        downloader = Downloader(progress_bar_class=ProgressBar)
+            version, filename, sha256sum=None, progress=True):
+        downloader = Downloader(
+            progress_bar_class=ProgressBar if progress else None
+        )
 
         if len(pkg_name) > 3 and pkg_name.startswith("lib"):
             first_letter = pkg_name[3]
@@ -191,24 +248,188 @@ class SourceCache:
             rel_path
         ])
 
-        h = hashlib.sha256()
-
         LOGGER.info("retrieving upstream {}".format(upstream_source))
         try:
             os.makedirs(os.path.dirname(target_url), exist_ok=True)
 
-            with open(target_url, "wb+") as f:
-                for chunk in downloader.get(upstream_source, digest=h):
-                    f.write(chunk)
+            digest = downloader.download_file(
+                upstream_source,
+                target_url,
+                sha256sum=sha256sum,
+                segments=self.DOWNLOAD_SEGMENTS
+            )
         except urllib.error.URLError as e:
             raise NetworkError(
                 "failed to retrieve {}: {}".format(upstream_source, e.reason)
             )
 
-        if sha256sum and sha256sum != h.hexdigest():
-            raise BoltError("file {} has invalid checksum!".format(target_url))
-
+        self._store_blob(target_url, digest)
         return target_url
     #end function
 
+    # PRIVATE
+
+    def _collect_garbage(self, max_size, keep):
+        blobs = []
+
+        for dirpath, _, filenames in os.walk(self._blob_dir()):
+            for filename in filenames:
+                if filename.endswith(self.VERIFIED_SUFFIX):
+                    continue
+                abs_path = os.path.join(dirpath, filename)
+                try:
+                    blobs.append((os.stat(abs_path), abs_path))
+                except OSError:
+                    pass
+            #end for
+        #end for
+
+        total_size = sum(st.st_size for st, _ in blobs)
+        if total_size <= max_size:
+            return
+
+        references = {}
+        dists_dir  = os.path.join(self.cache_dir, "bolt", "dists")
+
+        for dirpath, _, filenames in os.walk(dists_dir):
+            for filename in filenames:
+                abs_path = os.path.join(dirpath, filename)
+                try:
+                    st = os.stat(abs_path)
+                except OSError:
+                    continue
+                references\
+                    .setdefault((st.st_dev, st.st_ino), [])\
+                    .append(abs_path)
+            #end for
+        #end for
+
+        for st, blob_file in sorted(blobs, key=lambda x: x[0].st_atime_ns):
+            if total_size <= max_size:
+                break
+            if os.path.basename(blob_file) in keep:
+                continue
+
+            LOGGER.info("evicting {} from source cache".format(blob_file))
+
+            files_to_delete = \
+                references.get((st.st_dev, st.st_ino), []) + \
+                [blob_file, blob_file + self.VERIFIED_SUFFIX]
+
+            for filename in files_to_delete:
+                try:
+                    os.unlink(filename)
+                except OSError:
+                    pass
+            #end for
+
+            total_size -= st.st_size
+        #end for
+    #end function
+
+    def _blob_dir(self):
+        return os.path.join(self.cache_dir, "bolt", "blobs", "sha256")
+
+    def _blob_path(self, sha256sum):
+        return os.path.join(self._blob_dir(), sha256sum[:2], sha256sum)
+
+    def _store_blob(self, abs_path, sha256sum):
+        """
+        Moves a verified file into the blob store and replaces it with a link
+        to the blob. If the blob already exists, the file is simply replaced.
+        """
+        blob_file = self._blob_path(sha256sum)
+
+        with self._lock:
+            self._in_use.add(sha256sum)
+
+            try:
+                if not self._is_verified(blob_file, sha256sum):
+                    os.makedirs(os.path.dirname(blob_file), exist_ok=True)
+                    try:
+                        os.replace(abs_path, blob_file)
+                    except OSError:
+                        shutil.copyfile(abs_path, blob_file)
+                    self._mark_verified(blob_file, sha256sum)
+                    os.chmod(blob_file, 0o0444)
+                #end if
+
+                self._link_blob(blob_file, abs_path)
+                self._touch_blob(blob_file)
+            except OSError as e:
+                LOGGER.warning(
+                    "failed to add {} to blob store: {}"
+                    .format(abs_path, str(e))
+                )
+            #end try
+        #end with
+
+        if self.max_size is not None:
+            self.collect_garbage()
+    #end function
+
+    def _link_blob(self, blob_file, abs_path):
+        try:
+            if os.path.samefile(blob_file, abs_path):
+                return
+        except OSError:
+            pass
+
+        os.makedirs(os.path.dirname(abs_path), exist_ok=True)
+
+        tmp_path = "{}.{}-{}.tmp".format(
+            abs_path, os.getpid(), threading.get_ident()
+        )
+
+        try:
+            os.link(blob_file, tmp_path)
+        except OSError:
+            os.symlink(blob_file, tmp_path)
+        os.replace(tmp_path, abs_path)
+    #end function
+
+    def _touch_blob(self, blob_file):
+        try:
+            st = os.stat(blob_file)
+            os.utime(blob_file, ns=(time.time_ns(), st.st_mtime_ns))
+        except OSError:
+            pass
+    #end function
+
+    def _verified_tag(self, blob_file, sha256sum):
+        st = os.stat(blob_file)
+        return "{}:{}:{}".format(sha256sum, st.st_size, st.st_mtime_ns)
+
+    def _mark_verified(self, blob_file, sha256sum):
+        tag = self._verified_tag(blob_file, sha256sum)
+
+        try:
+            os.setxattr(blob_file, self.VERIFIED_XATTR, tag.encode("utf-8"))
+        except (OSError, AttributeError):
+            with open(blob_file + self.VERIFIED_SUFFIX, "w",
+                    encoding="utf-8") as f:
+                f.write(tag)
+        #end try
+    #end function
+
+    def _is_verified(self, blob_file, sha256sum):
+        try:
+            expected = self._verified_tag(blob_file, sha256sum)
+        except OSError:
+            return False
+
+        try:
+            tag = os.getxattr(blob_file, self.VERIFIED_XATTR).decode("utf-8")
+        except (OSError, AttributeError):
+            try:
+                with open(blob_file + self.VERIFIED_SUFFIX, "r",
+                        encoding="utf-8") as f:
+                    tag = f.read().strip()
+            except OSError:
+                return False
+        #end try
+
+        return tag == expected
+    #end function
+
 #end class
@@ -24,7 +24,6 @@
 #
 
 import copy
-import hashlib
 import logging
 import os
 import re
@@ -32,11 +31,13 @@ import shutil
 import subprocess
 import sys
 
+from concurrent.futures import ThreadPoolExecutor
 from lxml import etree
 
 from boltlinux.error import PackagingError
 from boltlinux.ffi.libarchive import ArchiveFileReader
 
+from boltlinux.miscellaneous.filehasher import FileHasher
 from boltlinux.miscellaneous.platform import Platform
 
 from boltlinux.package.boltpack.packagedesc import PackageDescription
@@ -50,6 +51,8 @@ class SourcePackage(BasePackage):
         os.path.dirname(os.path.realpath(__file__)), "helpers"
     )
 
+    MAX_PARALLEL_DOWNLOADS = 4
+
     def __init__(self, xml_config, copy_archives=True, **kwargs):
         build_for = kwargs.get("build_for", "target")
 
@@ -150,48 +153,42 @@ class SourcePackage(BasePackage):
         return self.relations["requires"]
 
     def unpack(self, source_dir=".", source_cache=None):
-        for source, upstream_source, subdir, sha256sum in self.sources:
-            archive_file = self._retrieve_archive_file(
-                source,
-                upstream_source,
-                sha256sum,
-                source_cache=source_cache,
-            )
-
-            if not (archive_file and os.path.isfile(archive_file)):
-                msg = "source archive for '%s' not found." % source
-                raise PackagingError(msg)
-
-            source_dir_and_subdir = os.path.normpath(
-                source_dir + os.sep + subdir
-            )
-            os.makedirs(source_dir_and_subdir, exist_ok=True)
-
-            LOGGER.info("unpacking {}".format(archive_file))
-
-            m = re.match(
-                r"^(.*?\.debdiff)\.(?:gz|xz|bz2)$",
-                os.path.basename(archive_file)
-            )
+        # Retrieve all archives concurrently, but unpack them in the given
+        # order, because later sources may be unpacked on top of earlier ones.
+        # Progress bars are only drawn if there is a single download.
+        progress = len(self.sources) == 1
+
+        with ThreadPoolExecutor(max_workers=self.MAX_PARALLEL_DOWNLOADS) \
+                as executor:
+            futures = [
+                executor.submit(
+                    self._retrieve_archive_file,
+                    source,
+                    upstream_source,
+                    sha256sum,
+                    source_cache=source_cache,
+                    progress=progress
+                )
+                for source, upstream_source, _, sha256sum in self.sources
+            ]
 
-            if m:
-                with ArchiveFileReader(archive_file, raw=True) as archive:
-                    try:
-                        next(iter(archive))
-                    except StopIteration:
-                        continue
-
-                    outfile = os.path.join(source_dir_and_subdir, m.group(1))
-                    with open(outfile, "wb+") as f:
-                        for chunk in iter(lambda: archive.read_data(4096),
-                                b""):
-                            f.write(chunk)
-            else:
-                with ArchiveFileReader(archive_file) as archive:
-                    archive.unpack_to_disk(
-                        base_dir=source_dir_and_subdir,
-                        strip_components=1
-                    )
+            try:
+                for (source, _, subdir, _), future in zip(
+                        self.sources, futures):
+                    archive_file = future.result()
+
+                    if not (archive_file and os.path.isfile(archive_file)):
+                        msg = "source archive for '%s' not found." % source
+                        raise PackagingError(msg)
+
+                    self._unpack_archive_file(archive_file, source_dir, subdir)
+                #end for
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+            #end try
+        #end with
 
         return self
     #end function
@@ -264,8 +261,41 @@ class SourcePackage(BasePackage):
 
     # PRIVATE
 
+    def _unpack_archive_file(self, archive_file, source_dir, subdir):
+        source_dir_and_subdir = os.path.normpath(
+            source_dir + os.sep + subdir
+        )
+        os.makedirs(source_dir_and_subdir, exist_ok=True)
+
+        LOGGER.info("unpacking {}".format(archive_file))
+
+        m = re.match(
+            r"^(.*?\.debdiff)\.(?:gz|xz|bz2)$",
+            os.path.basename(archive_file)
+        )
+
+        if m:
+            with ArchiveFileReader(archive_file, raw=True) as archive:
+                try:
+                    next(iter(archive))
+                except StopIteration:
+                    return
+
+                outfile = os.path.join(source_dir_and_subdir, m.group(1))
+                with open(outfile, "wb+") as f:
+                    for chunk in iter(lambda: archive.read_data(4096),
+                            b""):
+                        f.write(chunk)
+        else:
+            with ArchiveFileReader(archive_file) as archive:
+                archive.unpack_to_disk(
+                    base_dir=source_dir_and_subdir,
+                    strip_components=1
+                )
+    #end function
+
     def _retrieve_archive_file(self, source, upstream_source, sha256sum,
-            source_cache):
+            source_cache, progress=True):
         src_xml_dir = os.path.join(
             self.basedir, "archive", self.name, self.version
         )
@@ -279,12 +309,8 @@ class SourcePackage(BasePackage):
                 .format(source_file)
             )
 
-            h = hashlib.sha256()
-            with open(source_file, "rb") as f:
-                for chunk in iter(lambda: f.read(4096), b""):
-                    h.update(chunk)
-
-            if sha256sum != h.hexdigest():
+            if sha256sum != FileHasher.instance().sha256(source_file,
+                    memoize=False):
                 raise PackagingError(
                     "local candidate {} has incorrect checksum, aborting."
                 )
@@ -299,7 +325,8 @@ class SourcePackage(BasePackage):
                 self.version,
                 source,
                 upstream_source,
-                sha256sum
+                sha256sum,
+                progress=progress
             )
             if source_file:
                 LOGGER.info("cached at: {}".format(source_file))
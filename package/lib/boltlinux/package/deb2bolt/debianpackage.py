@@ -214,8 +214,7 @@ class DebianPackage(PackageUtilsMixin):
                     data_tarball = os.path.join(tmpdir, entry.pathname)
 
                     with open(data_tarball, "wb+") as f:
-                        for chunk in iter(
-                                lambda: archive.read_data(4096), b""):
+                        for chunk in archive.iter_data():
                             f.write(chunk)
                         #end for
                     #end with
@@ -23,15 +23,24 @@
 # THE SOFTWARE.
 #
 
-import hashlib
+import array
 import itertools
 import logging
+import mmap
 import os
 import re
+import struct
+import sys
+import threading
+import urllib.parse
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from tempfile import NamedTemporaryFile
 
 from boltlinux.error import BoltError
 from boltlinux.ffi.libarchive import ArchiveFileReader
 from boltlinux.miscellaneous.downloader import Downloader
+from boltlinux.miscellaneous.filehasher import FileHasher
 from boltlinux.miscellaneous.userinfo import UserInfo
 
 from boltlinux.package.boltpack.debianpackagemetadata import \
@@ -42,26 +51,31 @@ LOGGER = logging.getLogger(__name__)
 
 class DebianPackageDict:
 
-    def __init__(self):
-        self._dict = {}
+    def __init__(self, index=None):
+        self._dict  = {}
+        self._index = index
 
     def keys(self):
         for version in self._dict.keys():
             yield DebianPackageVersion(version)
 
     def values(self):
-        return iter(self._dict.values())
+        for value in self._dict.values():
+            yield self._resolve(value)
 
     def items(self):
-        for version, pkg_obj in self._dict.items():
-            yield DebianPackageVersion(version), pkg_obj
+        for version, value in self._dict.items():
+            yield DebianPackageVersion(version), self._resolve(value)
 
     def __iter__(self):
         for version in self._dict.keys():
             yield DebianPackageVersion(version)
 
+    def __len__(self):
+        return len(self._dict)
+
     def __getitem__(self, key):
-        return self._dict[str(key)]
+        return self._resolve(self._dict[str(key)])
 
     def __setitem__(self, key, value):
         self._dict[str(key)] = value
@@ -70,10 +84,215 @@ class DebianPackageDict:
         return str(key) in self._dict
 
     def get(self, key, default=None):
-        return self._dict.get(key, default)
+        value = self._dict.get(str(key))
+        if value is None:
+            return default
+        return self._resolve(value)
 
     def setdefault(self, key, default=None):
-        return self._dict.setdefault(key, default)
+        return self._resolve(self._dict.setdefault(str(key), default))
+
+    # PRIVATE
+
+    def _resolve(self, value):
+        if isinstance(value, int) and self._index is not None:
+            return self._index.metadata(value)
+        return value
+
+#end class
+
+class DebianPackageIndex:
+    """
+    Maps package names to DebianPackageDicts without keeping an object per
+    stanza around. Each index file is stored as a single blob and stanzas are
+    referenced by offset. DebianPackageMetaData objects are created on first
+    access.
+    """
+
+    FIELD_REGEX = re.compile(
+        rb"^(Package|Version|Source):[ \t]*([^\n]*?)[ \t]*$", re.M
+    )
+
+    SOURCE_VERSION_REGEX = re.compile(rb"\((.*?)\)\s*$")
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._blobs    = []
+        self._blob_ids = array.array("H")
+        self._offsets  = array.array("Q")
+        self._ends     = array.array("Q")
+        self._versions = []
+        self._packages = {}
+        self._objects  = {}
+    #end function
+
+    @classmethod
+    def scan_blob(cls, blob):
+        """
+        Returns the package names, versions, start and end offsets of all
+        stanzas in blob as four parallel sequences.
+        """
+        names    = []
+        versions = []
+        offsets  = array.array("Q")
+        ends     = array.array("Q")
+
+        blob_len = len(blob)
+        offset   = 0
+
+        while offset < blob_len:
+            end = blob.find(b"\n\n", offset)
+            if end == -1:
+                end = blob_len
+
+            entry = cls._scan_stanza(blob, offset, end)
+
+            if entry is not None:
+                names.append(entry[0])
+                versions.append(entry[1])
+                offsets.append(offset)
+                ends.append(end)
+            #end if
+
+            offset = end + 2
+        #end while
+
+        return names, versions, offsets, ends
+    #end function
+
+    def add_blob(self, blob, base_url="", suite="", component="",
+            columns=None):
+        if columns is None:
+            columns = self.scan_blob(blob)
+
+        blob_id = len(self._blobs)
+        self._blobs.append((blob, base_url, suite, component))
+
+        for name, version, start, end in zip(*columns):
+            self._add_entry(blob_id, name, version, start, end)
+    #end function
+
+    def metadata(self, entry_id):
+        meta_data = self._objects.get(entry_id)
+        if meta_data is not None:
+            return meta_data
+
+        blob, base_url, suite, component = \
+            self._blobs[self._blob_ids[entry_id]]
+
+        start = self._offsets[entry_id]
+        end   = self._ends[entry_id]
+
+        meta_data = DebianPackageMetaData(
+            bytes(blob[start:end]).decode("utf-8"), base_url=base_url
+        )
+
+        meta_data["Suite"]     = suite
+        meta_data["Component"] = component
+
+        self._objects[entry_id] = meta_data
+        return meta_data
+    #end function
+
+    def keys(self):
+        return self._packages.keys()
+
+    def items(self):
+        for name in self._packages:
+            yield name, self[name]
+
+    def values(self):
+        for name in self._packages:
+            yield self[name]
+
+    def get(self, name, default=None):
+        if name not in self._packages:
+            return default
+        return self[name]
+
+    def __iter__(self):
+        return iter(self._packages)
+
+    def __len__(self):
+        return len(self._packages)
+
+    def __contains__(self, name):
+        return name in self._packages
+
+    def __getitem__(self, name):
+        entry_ids = self._packages[name]
+
+        if isinstance(entry_ids, int):
+            entry_ids = [entry_ids]
+
+        result = DebianPackageDict(index=self)
+
+        for entry_id in entry_ids:
+            result[self._versions[entry_id]] = entry_id
+
+        return result
+    #end function
+
+    # PRIVATE
+
+    @classmethod
+    def _scan_stanza(cls, blob, start, end):
+        fields = {}
+
+        for m in cls.FIELD_REGEX.finditer(blob, start, end):
+            fields.setdefault(m.group(1), m.group(2))
+
+        if not fields:
+            return None
+
+        try:
+            name    = fields[b"Package"]
+            version = fields[b"Version"]
+        except KeyError:
+            raise BoltError(
+                "stanza at offset {} lacks package name or version."
+                .format(start)
+            )
+        #end try
+
+        # Same as in DebianPackageMetaData, use the source version if there is
+        # one.
+        if b"Source" in fields:
+            m = cls.SOURCE_VERSION_REGEX.search(fields[b"Source"])
+            if m:
+                version = m.group(1)
+        #end if
+
+        return sys.intern(name.decode("utf-8")), version.decode("utf-8")
+    #end function
+
+    def _add_entry(self, blob_id, name, version, start, end):
+        entry_ids = self._packages.get(name)
+
+        if entry_ids is None:
+            entry_ids = []
+        elif isinstance(entry_ids, int):
+            entry_ids = [entry_ids]
+
+        # The first occurrence of a version wins.
+        for entry_id in entry_ids:
+            if self._versions[entry_id] == version:
+                return
+
+        entry_id = len(self._versions)
+
+        self._blob_ids.append(blob_id)
+        self._offsets.append(start)
+        self._ends.append(end)
+        self._versions.append(version)
+
+        if not entry_ids:
+            self._packages[name] = entry_id
+        else:
+            self._packages[name] = tuple(entry_ids) + (entry_id,)
+    #end function
 
 #end class
 
@@ -82,11 +301,38 @@ class DebianPackageCache:
     SOURCE = 1
     BINARY = 2
 
+    SNAPSHOT_MAGIC  = b"BOLTDPC\x02"
+    SNAPSHOT_SUFFIX = ".snapshot"
+
+    MAX_CONNECTIONS_PER_HOST = 4
+
     class Error(BoltError):
         pass
 
+    class PackageList:
+
+        def __init__(self, suite, base_url, component, type_, source_url,
+                target, sha256sum):
+            self.suite      = suite
+            self.base_url   = base_url
+            self.component  = component
+            self.type_      = type_
+            self.source_url = source_url
+            self.target     = target
+            self.sha256sum  = sha256sum
+
+        @property
+        def snapshot_file(self):
+            return os.path.join(
+                os.path.dirname(self.target),
+                self.sha256sum + DebianPackageCache.SNAPSHOT_SUFFIX
+            )
+
+    #end class
+
     def __init__(self, release, arch="amd64", components=None, cache_dir=None,
-            security_enabled=True, updates_enabled=False, keyring=None):
+            security_enabled=True, updates_enabled=False, keyring=None,
+            jobs=None):
         self.release = release
         self.arch = arch
 
@@ -101,6 +347,10 @@ class DebianPackageCache:
 
         self._cache_dir = cache_dir
         self._keyring = keyring
+        self._jobs = jobs or os.cpu_count() or 1
+
+        self._host_semaphores = {}
+        self._host_semaphores_lock = threading.Lock()
 
         self.sources_list = [
             (
@@ -130,8 +380,8 @@ class DebianPackageCache:
             )
         #end if
 
-        self.source = {}
-        self.binary = {}
+        self.source = DebianPackageIndex()
+        self.binary = DebianPackageIndex()
     #end function
 
     def clear(self):
@@ -187,22 +437,50 @@ class DebianPackageCache:
             .format(self.release)
         )
 
-        for suite, base_url in self.sources_list:
-            inrelease = self._load_inrelease_file(suite, base_url, update=True)
-
-            for component, type_ in itertools.product(
-                    self.components, pkg_types):
+        num_hosts = len(
+            set(urllib.parse.urlparse(url).netloc
+                for _, url in self.sources_list)
+        )
 
-                self._load_package_list(
-                    suite,
-                    base_url,
-                    component,
-                    type_,
-                    update=True,
-                    inrelease=inrelease
+        with ThreadPoolExecutor(max_workers=num_hosts *
+                self.MAX_CONNECTIONS_PER_HOST) as executor:
+            inrelease_list = list(
+                executor.map(
+                    lambda entry: self._load_inrelease_file(
+                        *entry, update=True
+                    ),
+                    self.sources_list
                 )
+            )
+
+            package_lists = []
+
+            for (suite, base_url), inrelease in zip(
+                    self.sources_list, inrelease_list):
+                for component, type_ in itertools.product(
+                        self.components, pkg_types):
+                    package_lists.append(
+                        self._locate_package_list(
+                            suite, base_url, component, type_, inrelease
+                        )
+                    )
+                #end for
             #end for
-        #end for
+
+            list(
+                executor.map(
+                    lambda pkg_list: self._fetch_file(
+                        pkg_list.source_url, pkg_list.target
+                    ),
+                    package_lists
+                )
+            )
+        #end with
+
+        self._create_snapshots(package_lists)
+
+        for pkg_list in package_lists:
+            self._add_package_list(pkg_list)
     #end function
 
     # PRIVATE
@@ -213,42 +491,15 @@ class DebianPackageCache:
         source = "{}/{}".format(base_url, "InRelease")
         target = os.path.join(cache_dir, "InRelease")
 
-        if not os.path.islink(target):
-            old_tag = ""
-        else:
-            old_tag = os.path.basename(os.readlink(target))
-
-        new_tag = None
-
         if update:
-            try:
-                downloader = Downloader()
+            self._fetch_file(source, target)
 
-                if not os.path.isdir(cache_dir):
-                    os.makedirs(cache_dir)
-
-                new_tag = downloader.tag(source)
-                if old_tag != new_tag:
-                    downloader.download_named_tag(
-                        source, target, new_tag, permissions=0o0644
-                    )
-                    if old_tag:
-                        try:
-                            os.unlink(os.path.join(cache_dir, old_tag))
-                        except OSError:
-                            pass
-                    #end if
-                #end if
-            except Exception as e:
-                raise DebianPackageCache.Error(
-                    'failed to download "{}": {}'.format(source, str(e))
-                )
-            #end try
-        #end if
+        tag = os.path.basename(os.readlink(target)) \
+            if os.path.islink(target) else ""
 
         try:
             inrelease = InReleaseFile.load(
-                os.path.join(cache_dir, new_tag or old_tag)
+                os.path.join(cache_dir, tag)
             )
 
             if self._keyring:
@@ -269,7 +520,7 @@ class DebianPackageCache:
         except Exception as e:
             files_to_delete = [
                 target,
-                os.path.join(os.path.dirname(target), new_tag or old_tag)
+                os.path.join(os.path.dirname(target), tag)
             ]
 
             for filename in files_to_delete:
@@ -294,25 +545,31 @@ class DebianPackageCache:
                 suite, base_url, update=update
             )
 
+        pkg_list = self._locate_package_list(
+            suite, base_url, component, type_, inrelease
+        )
+
+        if update:
+            self._fetch_file(pkg_list.source_url, pkg_list.target)
+
+        self._add_package_list(pkg_list)
+    #end function
+
+    def _locate_package_list(self, suite, base_url, component, type_,
+            inrelease):
         cache_dir = os.path.join(self._cache_dir, "dists",
             self.release, suite, component, type_)
 
         if not os.path.isdir(cache_dir):
             os.makedirs(cache_dir)
 
-        source_url = None
-
         for ext in [".gz", ".xz"]:
             if type_ == "source":
                 filename = "Sources" + ext
                 source = f"{component}/source/{filename}"
-                target = os.path.join(cache_dir, filename)
-                cache = self.source
             else:
                 filename = "Packages" + ext
                 source = f"{component}/{type_}/{filename}"
-                target = os.path.join(cache_dir, filename)
-                cache = self.binary
             #end if
 
             try:
@@ -322,108 +579,326 @@ class DebianPackageCache:
                 )
             except KeyError:
                 continue
-            else:
-                break
-        #end for
+            #end try
 
-        if not source_url:
-            raise DebianPackageCache.Error(
-                'unable to locate index file for "{}" in "{}" '
-                'suite'.format(type_, suite)
+            return self.PackageList(
+                suite,
+                base_url,
+                component,
+                type_,
+                source_url,
+                os.path.join(cache_dir, filename),
+                sha256sum
             )
-        #end if
+        #end for
 
-        if not os.path.islink(target):
-            old_tag = ""
-        else:
-            old_tag = os.path.basename(os.readlink(target))
+        raise DebianPackageCache.Error(
+            'unable to locate index file for "{}" in "{}" '
+            'suite'.format(type_, suite)
+        )
+    #end function
 
-        new_tag = None
+    def _fetch_file(self, source_url, target):
+        cache_dir = os.path.dirname(target)
+        host      = urllib.parse.urlparse(source_url).netloc
 
-        if update:
-            try:
-                downloader = Downloader()
+        with self._host_semaphores_lock:
+            semaphore = self._host_semaphores.setdefault(
+                host,
+                threading.BoundedSemaphore(self.MAX_CONNECTIONS_PER_HOST)
+            )
+        #end with
 
+        with semaphore:
+            try:
                 if not os.path.isdir(cache_dir):
-                    os.makedirs(cache_dir)
+                    os.makedirs(cache_dir, exist_ok=True)
 
-                new_tag = downloader.tag(source_url)
-                if old_tag != new_tag:
-                    downloader.download_named_tag(
-                        source_url, target, new_tag, permissions=0o0644
-                    )
-                    if old_tag:
-                        try:
-                            os.unlink(os.path.join(cache_dir, old_tag))
-                        except OSError:
-                            pass
-                    #end if
-                #end if
+                Downloader().download_if_modified(
+                    source_url, target, permissions=0o0644
+                )
             except Exception as e:
                 raise DebianPackageCache.Error(
                     'failed to download "{}": {}'.format(source_url, str(e))
                 )
             #end try
-        #end if
+        #end with
+    #end function
 
-        try:
-            digest = hashlib.sha256()
+    def _create_snapshots(self, package_lists):
+        pending = [
+            pkg_list for pkg_list in package_lists
+                if not os.path.exists(pkg_list.snapshot_file)
+        ]
 
-            with open(target, "rb") as f:
-                for chunk in iter(lambda: f.read(4096), b""):
-                    digest.update(chunk)
+        if len(pending) < 2 or self._jobs < 2:
+            return
 
-            if digest.hexdigest() != sha256sum:
-                raise BoltError('wrong hash for "{}".'.format(target))
+        with ProcessPoolExecutor(max_workers=self._jobs) as executor:
+            futures = [
+                executor.submit(
+                    DebianPackageCache._create_snapshot,
+                    pkg_list.target,
+                    pkg_list.sha256sum,
+                    pkg_list.snapshot_file
+                )
+                for pkg_list in pending
+            ]
 
-            with ArchiveFileReader(target, raw=True) as archive:
+            for future in futures:
                 try:
-                    next(iter(archive))
-                except StopIteration:
-                    buf = ""
-                else:
-                    buf = archive.read_data().decode("utf-8")
+                    future.result()
+                except Exception as e:
+                    # Errors are reported when the list is loaded.
+                    LOGGER.debug(
+                        "failed to create snapshot: {}".format(str(e))
+                    )
+                #end try
+            #end for
+        #end with
+    #end function
+
+    def _add_package_list(self, pkg_list):
+        if pkg_list.type_ == "source":
+            cache = self.source
+        else:
+            cache = self.binary
 
-                pool_base = re.match(
-                    r"^(?P<pool_base>https?://.*?)/dists/.*$", base_url
-                ).group("pool_base")
+        pool_base = re.match(
+            r"^(?P<pool_base>https?://.*?)/dists/.*$", pkg_list.base_url
+        ).group("pool_base")
 
-                for chunk in re.split(r"\n\n+", buf, flags=re.MULTILINE):
-                    chunk = chunk.strip()
-                    if not chunk:
-                        continue
+        snapshot = self._load_snapshot(pkg_list.snapshot_file)
 
-                    meta_data = DebianPackageMetaData(
-                        chunk, base_url=pool_base)
+        if snapshot is not None:
+            blob, columns = snapshot
+        else:
+            target = pkg_list.target
 
-                    meta_data["Suite"]     = suite
-                    meta_data["Component"] = component
+            try:
+                blob, columns = self._parse_package_list(
+                    target, pkg_list.sha256sum
+                )
+            except Exception as e:
+                files_to_delete = [target]
 
-                    pkg_name    = meta_data["Package"]
-                    pkg_version = meta_data["Version"]
+                if os.path.islink(target):
+                    files_to_delete.append(
+                        os.path.join(
+                            os.path.dirname(target), os.readlink(target)
+                        )
+                    )
+                #end if
 
-                    cache\
-                        .setdefault(pkg_name, DebianPackageDict())\
-                        .setdefault(pkg_version, meta_data)
+                for filename in files_to_delete:
+                    try:
+                        os.unlink(filename)
+                    except OSError:
+                        pass
                 #end for
-            #end with
+
+                raise DebianPackageCache.Error(
+                    'failed to load "{}": {}'.format(target, str(e))
+                )
+            #end try
+
+            self._store_snapshot(pkg_list.snapshot_file, blob, columns)
+        #end if
+
+        cache.add_blob(
+            blob,
+            base_url=pool_base,
+            suite=pkg_list.suite,
+            component=pkg_list.component,
+            columns=columns
+        )
+    #end function
+
+    @classmethod
+    def _create_snapshot(cls, target, sha256sum, snapshot_file):
+        blob, columns = cls._parse_package_list(target, sha256sum)
+        cls._store_snapshot(snapshot_file, blob, columns)
+    #end function
+
+    @staticmethod
+    def _parse_package_list(target, sha256sum):
+        if FileHasher.instance().sha256(target, memoize=False) != sha256sum:
+            raise BoltError('wrong hash for "{}".'.format(target))
+
+        with ArchiveFileReader(target, raw=True) as archive:
+            try:
+                next(iter(archive))
+            except StopIteration:
+                blob = b""
+            else:
+                blob = archive.read_data()
+        #end with
+
+        return blob, DebianPackageIndex.scan_blob(blob)
+    #end function
+
+    def _load_snapshot(self, filename):
+        if not os.path.exists(filename):
+            return None
+
+        try:
+            with open(filename, "rb") as f:
+                snapshot = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+            blob, columns = self._decode_snapshot(snapshot)
         except Exception as e:
-            files_to_delete = [
-                target,
-                os.path.join(os.path.dirname(target), new_tag or old_tag)
-            ]
+            LOGGER.warning(
+                'discarding snapshot "{}": {}'.format(filename, str(e))
+            )
+            try:
+                os.unlink(filename)
+            except OSError:
+                pass
+            return None
+        #end try
 
-            for filename in files_to_delete:
+        return blob, columns
+    #end function
+
+    @classmethod
+    def _decode_snapshot(cls, snapshot):
+        """
+        Snapshot layout, all integers are little endian uint64:
+
+            magic | count | strings_len | offsets[count] | ends[count] |
+            name_lens[count] | version_lens[count] | strings | blob
+
+        strings holds the UTF-8 encoded names followed by the versions.
+        """
+        magic_len = len(cls.SNAPSHOT_MAGIC)
+
+        if len(snapshot) < magic_len + 16:
+            raise ValueError("truncated snapshot header")
+        if snapshot[:magic_len] != cls.SNAPSHOT_MAGIC:
+            raise ValueError("bad magic")
+
+        count, strings_len = struct.unpack_from("<QQ", snapshot, magic_len)
+
+        arrays_start = magic_len + 16
+        strings_start = arrays_start + 4 * 8 * count
+        blob_start = strings_start + strings_len
+
+        if blob_start > len(snapshot):
+            raise ValueError("truncated snapshot")
+
+        arrays = []
+
+        for i in range(4):
+            column = array.array("Q")
+            column.frombytes(snapshot[
+                arrays_start + i * 8 * count:arrays_start + (i + 1) * 8 * count
+            ])
+            if sys.byteorder != "little":
+                column.byteswap()
+            arrays.append(column)
+        #end for
+
+        offsets, ends, name_lens, version_lens = arrays
+
+        if sum(name_lens) + sum(version_lens) != strings_len:
+            raise ValueError("inconsistent string table")
+
+        # Entries are sliced out of the blob later on, a damaged index must
+        # not point past its end.
+        blob_len = len(snapshot) - blob_start
+
+        for offset, end in zip(offsets, ends):
+            if not offset <= end <= blob_len:
+                raise ValueError("entry out of bounds")
+        #end for
+
+        strings = snapshot[strings_start:blob_start]
+        pos     = 0
+
+        def decode(lengths):
+            nonlocal pos
+            result = []
+            for length in lengths:
+                result.append(strings[pos:pos + length].decode("utf-8"))
+                pos += length
+            return result
+        #end function
+
+        names    = [sys.intern(name) for name in decode(name_lens)]
+        versions = decode(version_lens)
+        blob     = memoryview(snapshot)[blob_start:]
+
+        return blob, (names, versions, offsets, ends)
+    #end function
+
+    @classmethod
+    def _encode_snapshot_header(cls, columns):
+        names, versions, offsets, ends = columns
+
+        names    = [name.encode("utf-8") for name in names]
+        versions = [version.encode("utf-8") for version in versions]
+
+        arrays = [
+            array.array("Q", offsets),
+            array.array("Q", ends),
+            array.array("Q", [len(name) for name in names]),
+            array.array("Q", [len(version) for version in versions])
+        ]
+
+        strings = b"".join(names) + b"".join(versions)
+        parts   = [
+            cls.SNAPSHOT_MAGIC,
+            struct.pack("<QQ", len(names), len(strings))
+        ]
+
+        for column in arrays:
+            if sys.byteorder != "little":
+                column.byteswap()
+            parts.append(column.tobytes())
+        #end for
+
+        parts.append(strings)
+        return b"".join(parts)
+    #end function
+
+    @classmethod
+    def _store_snapshot(cls, filename, blob, columns):
+        cache_dir = os.path.dirname(filename)
+        header    = cls._encode_snapshot_header(columns)
+
+        tmp_name = None
+
+        try:
+            with NamedTemporaryFile(dir=cache_dir, delete=False) as tmp_file:
+                tmp_name = tmp_file.name
+                tmp_file.write(header)
+                tmp_file.write(blob)
+
+            os.chmod(tmp_name, 0o0644)
+            os.replace(tmp_name, filename)
+        except OSError as e:
+            LOGGER.warning(
+                'failed to store snapshot "{}": {}'.format(filename, str(e))
+            )
+            if tmp_name:
                 try:
-                    os.unlink(filename)
+                    os.unlink(tmp_name)
                 except OSError:
                     pass
-            #end for
-
-            raise DebianPackageCache.Error(
-                'failed to load "{}": {}'.format(target, str(e))
-            )
+            #end if
+            return
         #end try
+
+        for entry in os.listdir(cache_dir):
+            if not entry.endswith(cls.SNAPSHOT_SUFFIX):
+                continue
+            if entry == os.path.basename(filename):
+                continue
+            try:
+                os.unlink(os.path.join(cache_dir, entry))
+            except OSError:
+                pass
+        #end for
     #end function
 
 #end class
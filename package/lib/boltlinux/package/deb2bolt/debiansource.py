@@ -121,6 +121,8 @@ SOURCE_PKG_XML_TEMPLATE = """\
 
 class DebianSource(PackageUtilsMixin):
 
+    DOWNLOAD_SEGMENTS = 4
+
     def __init__(self, pkg_cache, pkg_name, version=None, release="stable",
             arch="amd64", work_dir=".", create_patch_tarball=False):
         """
@@ -201,10 +203,14 @@ class DebianSource(PackageUtilsMixin):
 
             LOGGER.info("fetching {}".format(url))
 
-            with open(outfile, "wb+") as f:
-                for chunk in downloader.get(url):
-                    f.write(chunk)
-            #end with
+            sha256sum = self.files.get(filename, (None, None))[0]
+
+            downloader.download_file(
+                url,
+                outfile,
+                sha256sum=sha256sum,
+                segments=self.DOWNLOAD_SEGMENTS
+            )
         #end for
 
         return self
@@ -23,7 +23,6 @@
 # THE SOFTWARE.
 #
 
-import hashlib
 import os
 import re
 import shutil
@@ -32,6 +31,7 @@ import boltlinux.ffi.libarchive as libarchive
 
 from boltlinux.error import BoltError
 from boltlinux.ffi.libarchive import ArchiveFileWriter
+from boltlinux.miscellaneous.filehasher import FileHasher
 
 class QuiltPatchSeries:
 
@@ -110,7 +110,7 @@ class QuiltPatchSeries:
         #end with
 
         size      = os.path.getsize(tarfile)
-        sha256sum = self._file_sha256_sum(tarfile)
+        sha256sum = FileHasher.instance().sha256(tarfile, memoize=False)
 
         return (sha256sum, size)
     #end function
@@ -137,14 +137,4 @@ class QuiltPatchSeries:
         #end for
     #end function
 
-    # PRIVATE
-
-    def _file_sha256_sum(self, filename):
-        h = hashlib.sha256()
-        with open(filename, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                h.update(chunk)
-        return h.hexdigest()
-    #end function
-
 #end class
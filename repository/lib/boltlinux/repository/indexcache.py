@@ -0,0 +1,220 @@
+# -*- encoding: utf-8 -*-
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2021 Tobias Koch <tobias.koch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+import os
+import sqlite3
+
+from boltlinux.error import RepositoryError
+
+class IndexCache:
+
+    SCHEMA_VERSION = 1
+
+    def __init__(self, filename):
+        self._filename = filename
+        self._conn     = None
+        self._entries  = {}
+        self._meta     = {}
+        self._dirty    = set()
+        self._removed  = set()
+        self._cleared  = False
+    #end function
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        self.close()
+    #end function
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, path):
+        return path in self._entries
+
+    @staticmethod
+    def stat_key(stats):
+        return "{}:{}:{}:{}".format(
+            stats.st_dev, stats.st_ino, stats.st_size, stats.st_mtime_ns
+        )
+    #end function
+
+    def open(self):
+        try:
+            self._load()
+        except sqlite3.DatabaseError:
+            # The cache is disposable, start over if it is unusable.
+            self.close()
+            try:
+                os.unlink(self._filename)
+            except OSError:
+                pass
+            try:
+                self._load()
+            except sqlite3.Error as e:
+                raise RepositoryError(
+                    "failed to open index cache '{}': {}"
+                    .format(self._filename, str(e))
+                )
+            #end try
+        #end try
+    #end function
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+    #end function
+
+    def paths(self):
+        return list(self._entries.keys())
+
+    def items(self):
+        for path, (stat_key, stanza) in self._entries.items():
+            yield path, stat_key, stanza
+    #end function
+
+    def lookup(self, path, stat_key):
+        entry = self._entries.get(path)
+
+        if entry is None or entry[0] != stat_key:
+            return None
+
+        return entry[1]
+    #end function
+
+    def update(self, path, stat_key, stanza):
+        self._entries[path] = (stat_key, stanza)
+        self._dirty.add(path)
+        self._removed.discard(path)
+    #end function
+
+    def remove(self, path):
+        if self._entries.pop(path, None) is not None:
+            self._removed.add(path)
+        self._dirty.discard(path)
+    #end function
+
+    def clear(self):
+        self._entries.clear()
+        self._meta.clear()
+        self._dirty.clear()
+        self._removed.clear()
+        self._cleared = True
+    #end function
+
+    def get_meta(self, key, default=None):
+        return self._meta.get(key, default)
+
+    def set_meta(self, key, value):
+        self._meta[key] = value
+
+    def commit(self):
+        if self._conn is None:
+            return
+
+        try:
+            with self._conn:
+                if self._cleared:
+                    self._conn.execute("DELETE FROM packages")
+
+                self._conn.executemany(
+                    "DELETE FROM packages WHERE path = ?",
+                    [(path,) for path in self._removed]
+                )
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO packages (path, stat_key, stanza) "
+                    "VALUES (?, ?, ?)",
+                    [
+                        (path, *self._entries[path])
+                            for path in self._dirty
+                    ]
+                )
+
+                self._conn.execute("DELETE FROM meta")
+                self._conn.executemany(
+                    "INSERT INTO meta (key, value) VALUES (?, ?)",
+                    list(self._meta.items())
+                )
+            #end with
+        except sqlite3.Error as e:
+            raise RepositoryError(
+                "failed to update index cache '{}': {}"
+                .format(self._filename, str(e))
+            )
+        #end try
+
+        self._dirty.clear()
+        self._removed.clear()
+        self._cleared = False
+    #end function
+
+    # PRIVATE
+
+    def _load(self):
+        self._conn = sqlite3.connect(self._filename)
+
+        version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+
+        with self._conn:
+            if version != IndexCache.SCHEMA_VERSION:
+                self._conn.execute("DROP TABLE IF EXISTS packages")
+                self._conn.execute("DROP TABLE IF EXISTS meta")
+                self._conn.execute(
+                    "CREATE TABLE packages ("
+                    "path TEXT PRIMARY KEY, "
+                    "stat_key TEXT NOT NULL, "
+                    "stanza TEXT NOT NULL)"
+                )
+                self._conn.execute(
+                    "CREATE TABLE meta ("
+                    "key TEXT PRIMARY KEY, "
+                    "value TEXT)"
+                )
+                self._conn.execute(
+                    "PRAGMA user_version = {:d}"
+                    .format(IndexCache.SCHEMA_VERSION)
+                )
+            #end if
+        #end with
+
+        rows = self._conn.execute(
+            "SELECT path, stat_key, stanza FROM packages"
+        )
+
+        self._entries = {
+            path: (stat_key, stanza) for path, stat_key, stanza in rows
+        }
+
+        self._meta = dict(
+            self._conn.execute("SELECT key, value FROM meta")
+        )
+    #end function
+
+#end class
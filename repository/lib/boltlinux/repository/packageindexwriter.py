@@ -0,0 +1,278 @@
+# -*- encoding: utf-8 -*-
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2021 Tobias Koch <tobias.koch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+import hashlib
+import os
+import stat
+
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import NamedTemporaryFile
+
+import boltlinux.ffi.libarchive as libarchive
+
+from boltlinux.ffi.libarchive import ArchiveFileWriter, ArchiveEntry
+from boltlinux.error import BoltValueError
+from boltlinux.miscellaneous.platform import Platform
+
+class PackageIndexWriter:
+
+    COMPRESSION_FORMATS = {
+        "gz":   (".gz",  libarchive.COMPRESSION_GZIP, "gzip"),
+        "xz":   (".xz",  libarchive.COMPRESSION_XZ,   "xz"),
+        "zstd": (".zst", libarchive.COMPRESSION_ZSTD, "zstd"),
+    }
+
+    SIGNED_HEADER = "-----BEGIN SIGNIFY SIGNED MESSAGE-----\n"
+
+    SIGNED_TRAILER = \
+        "-----BEGIN SIGNIFY SIGNATURE-----\n" \
+        "{signature}" \
+        "-----END SIGNIFY SIGNATURE-----\n"
+
+    def __init__(self, repo_dir, compression=None, signer=None, threads=1,
+            block_size=1024*1024):
+        if not compression:
+            compression = ["gz"]
+
+        for fmt in compression:
+            if fmt not in PackageIndexWriter.COMPRESSION_FORMATS:
+                raise BoltValueError(
+                    "unsupported index compression '{}'.".format(fmt)
+                )
+        #end for
+
+        self._repo_dir    = repo_dir
+        self._compression = compression
+        self._signer      = signer
+        self._threads     = max(1, threads)
+        self._block_size  = block_size
+
+        self._digest      = hashlib.sha256()
+        self._buffer      = []
+        self._buffered    = 0
+        self._outputs     = []
+        self._signed      = []
+        self._plain_file  = None
+        self._executor    = None
+    #end function
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def files(self):
+        return [target for target, _, _ in self._outputs]
+
+    def open(self):
+        try:
+            for fmt in self._compression:
+                ext = PackageIndexWriter.COMPRESSION_FORMATS[fmt][0]
+
+                self._outputs.append(
+                    self._open_output("Packages" + ext, fmt)
+                )
+
+                if self._signer:
+                    output = self._open_output("InPackages" + ext, fmt)
+                    output[2].write_data(
+                        PackageIndexWriter.SIGNED_HEADER.encode("utf-8")
+                    )
+                    self._outputs.append(output)
+                    self._signed.append(output)
+                #end if
+            #end for
+
+            if self._signer:
+                self._plain_file = NamedTemporaryFile(dir=self._repo_dir,
+                        delete=False)
+
+            # Compressors run in libarchive with the GIL released, so the
+            # different output formats are compressed concurrently.
+            if len(self._outputs) > 1:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=len(self._outputs)
+                )
+        except Exception:
+            self.close()
+            raise
+    #end function
+
+    def write(self, text):
+        data = text.encode("utf-8")
+
+        self._buffer.append(data)
+        self._buffered += len(data)
+
+        if self._buffered >= self._block_size:
+            self._flush()
+    #end function
+
+    def commit(self, current_digest=None):
+        self._flush()
+
+        signature = None
+
+        if self._signer:
+            self._plain_file.close()
+            signature = self._signer(self._plain_file.name)
+
+            trailer = PackageIndexWriter.SIGNED_TRAILER\
+                .format(signature=signature)\
+                .encode("utf-8")
+
+            for _, _, archive in self._signed:
+                archive.write_data(trailer)
+        #end if
+
+        for _, _, archive in self._outputs:
+            archive.close()
+
+        digest  = self._digest.hexdigest()
+        changed = digest != current_digest
+
+        for target, tempfile, _ in self._outputs:
+            if changed or not os.path.exists(target):
+                self._install_file(tempfile, target)
+        #end for
+
+        if signature is not None:
+            packages_sig = os.path.join(self._repo_dir, "Packages.sig")
+
+            if changed or not os.path.exists(packages_sig):
+                with NamedTemporaryFile(dir=self._repo_dir, mode="w+",
+                        delete=False, encoding="utf-8") as tempfile_sig:
+                    tempfile_sig.write(signature)
+                self._install_file(tempfile_sig.name, packages_sig)
+            #end if
+        #end if
+
+        return digest, changed
+    #end function
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        #end if
+
+        for _, tempfile, archive in self._outputs:
+            archive.close()
+            if os.path.exists(tempfile):
+                os.unlink(tempfile)
+        #end for
+
+        if self._plain_file is not None:
+            self._plain_file.close()
+            if os.path.exists(self._plain_file.name):
+                os.unlink(self._plain_file.name)
+            self._plain_file = None
+        #end if
+    #end function
+
+    # PRIVATE
+
+    def _open_output(self, filename, fmt):
+        _, compression, filter_name = \
+            PackageIndexWriter.COMPRESSION_FORMATS[fmt]
+
+        cmd     = None
+        options = []
+
+        if fmt == "gz":
+            pigz = Platform.find_executable("pigz")
+
+            if self._threads > 1 and pigz:
+                cmd = "{} -n -p {:d}".format(pigz, self._threads)
+            else:
+                options.append(("gzip", "timestamp", None))
+        elif self._threads > 1:
+            options.append((filter_name, "threads", str(self._threads)))
+        #end if
+
+        with NamedTemporaryFile(dir=self._repo_dir, delete=False) as tempfile:
+            pass
+
+        try:
+            archive = ArchiveFileWriter(
+                tempfile.name,
+                libarchive.FORMAT_RAW,
+                compression,
+                options=options,
+                cmd=cmd
+            )
+
+            with ArchiveEntry() as archive_entry:
+                archive_entry.filetype = stat.S_IFREG
+                archive.write_entry(archive_entry)
+        except Exception:
+            os.unlink(tempfile.name)
+            raise
+        #end try
+
+        return os.path.join(self._repo_dir, filename), tempfile.name, archive
+    #end function
+
+    def _flush(self):
+        if not self._buffer:
+            return
+
+        data = b"".join(self._buffer)
+        self._buffer.clear()
+        self._buffered = 0
+
+        self._digest.update(data)
+
+        if self._plain_file is not None:
+            self._plain_file.write(data)
+
+        if self._executor is not None:
+            futures = [
+                self._executor.submit(archive.write_data, data)
+                    for _, _, archive in self._outputs
+            ]
+            for future in futures:
+                future.result()
+        else:
+            for _, _, archive in self._outputs:
+                archive.write_data(data)
+        #end if
+    #end function
+
+    def _install_file(self, tempfile, target):
+        os.chmod(
+            tempfile,
+            stat.S_IRUSR |
+            stat.S_IWUSR |
+            stat.S_IRGRP |
+            stat.S_IROTH
+        )
+        os.rename(tempfile, target)
+    #end function
+
+#end class
@@ -25,14 +25,17 @@
 
 import os
 import re
+import shutil
 import stat
+import time
 import shlex
 import subprocess
 import hashlib
 import functools
 import locale
 
-from tempfile import TemporaryDirectory, NamedTemporaryFile
+from concurrent.futures import ProcessPoolExecutor
+from tempfile import NamedTemporaryFile
 
 import boltlinux.ffi.libarchive as libarchive
 
@@ -40,24 +43,125 @@ from boltlinux.ffi.libarchive import (
     ArchiveFileReader, ArchiveFileWriter, ArchiveEntry
 )
 
-from boltlinux.error import NotFound, BoltSyntaxError, BoltError
+from boltlinux.error import NotFound, BoltSyntaxError, BoltError, \
+        BoltValueError
+from boltlinux.miscellaneous.filehasher import FileHasher
 from boltlinux.miscellaneous.xpkg import BaseXpkg
+from boltlinux.repository.indexcache import IndexCache
+from boltlinux.repository.packageindexwriter import PackageIndexWriter
 from boltlinux.package.boltpack.debianpackagemetadata \
         import DebianPackageMetaData
 
 class RepoIndexer:
 
-    def __init__(self, repo_dir, force_full=False, sign_with=None):
+    class DigestReader:
+
+        def __init__(self, fileobj, digest):
+            self.digest     = digest
+            self.bytes_read = 0
+            self._fileobj   = fileobj
+        #end function
+
+        def readinto(self, buf):
+            bytes_read = self._fileobj.readinto(buf)
+
+            if bytes_read:
+                self.digest.update(memoryview(buf)[:bytes_read])
+                self.bytes_read += bytes_read
+            #end if
+
+            return bytes_read
+        #end function
+
+        def drain(self, buf_size=64*1024):
+            buf = bytearray(buf_size)
+            while self.readinto(buf):
+                pass
+        #end function
+
+    #end class
+
+    CACHE_FILE = ".Packages.cache"
+
+    # Superseded by-hash files are kept around for this many seconds, so
+    # that clients in the middle of an update can still fetch them.
+    BY_HASH_RETENTION = 24 * 3600
+
+    def __init__(self, repo_dir, force_full=False, sign_with=None, jobs=1,
+            use_cache=True, by_hash=False, shard_by=None, compression=None,
+            executor=None, memo=None):
         if not os.path.isdir(repo_dir):
             raise NotFound("path '%s' does not exists or is not a directory."
                     % repo_dir)
+        if shard_by not in [None, "section", "letter"]:
+            raise BoltValueError(
+                "invalid shard type '{}', must be one of 'section' or "
+                "'letter'.".format(shard_by)
+            )
+        #end if
+
+        for fmt in (compression or []):
+            if fmt not in PackageIndexWriter.COMPRESSION_FORMATS:
+                raise BoltValueError(
+                    "unsupported index compression '{}'.".format(fmt)
+                )
+        #end for
+
+        self._force_full  = force_full
+        self._repo_dir    = repo_dir
+        self._sign_with   = sign_with
+        self._jobs        = max(1, jobs or os.cpu_count() or 1)
+        self._use_cache   = use_cache
+        self._by_hash     = by_hash
+        self._shard_by    = shard_by
+        self._compression = ["gz"] + [
+            fmt for fmt in (compression or []) if fmt != "gz"
+        ]
+        self._executor    = executor
+        self._memo        = memo
+    #end function
+
+    def __getstate__(self):
+        # Worker processes need neither the pool nor the shared memo.
+        state = self.__dict__.copy()
+        state["_executor"] = None
+        state["_memo"] = None
+        return state
+    #end function
+
+    @staticmethod
+    def update_package_indexes(repo_dirs, jobs=1, **kwargs):
+        jobs = max(1, jobs or os.cpu_count() or 1)
+        memo = {}
+
+        indexers = [
+            RepoIndexer(repo_dir, jobs=jobs, memo=memo, **kwargs)
+                for repo_dir in repo_dirs
+        ]
+
+        if jobs <= 1:
+            for indexer in indexers:
+                indexer.update_package_index()
+            return
+        #end if
 
-        self._force_full = force_full
-        self._repo_dir   = repo_dir
-        self._sign_with  = sign_with
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            for indexer in indexers:
+                indexer._executor = executor
+                indexer.update_package_index()
+            #end for
+        #end with
     #end function
 
     def update_package_index(self):
+        if self._use_cache:
+            cache_file = os.path.join(self._repo_dir, RepoIndexer.CACHE_FILE)
+
+            with IndexCache(cache_file) as cache:
+                self.update_package_index_from_cache(cache)
+            return
+        #end if
+
         if self._force_full:
             index, digest = {}, ""
         else:
@@ -78,6 +182,87 @@ class RepoIndexer:
         self.store_package_index(index, current_digest=digest)
     #end function
 
+    def update_package_index_from_cache(self, cache):
+        packages_gz = os.path.join(self._repo_dir, "Packages.gz")
+
+        if self._force_full:
+            cache.clear()
+        elif not len(cache) and os.path.exists(packages_gz):
+            self._seed_cache_from_package_index(cache)
+
+        pkg_files = {}
+
+        for abs_path in self._find_packages():
+            try:
+                stat_key = IndexCache.stat_key(os.stat(abs_path))
+            except OSError:
+                continue
+            pkg_files[self._pool_path(abs_path)] = (abs_path, stat_key)
+        #end for
+
+        removed = [path for path in cache.paths() if path not in pkg_files]
+        changed = [
+            (abs_path, stat_key)
+                for path, (abs_path, stat_key) in sorted(pkg_files.items())
+                    if cache.lookup(path, stat_key) is None
+        ]
+
+        for path in removed:
+            cache.remove(path)
+
+        stat_keys = dict(changed)
+
+        for abs_path, control_data in self._extract_control_data_from_files(
+                [abs_path for abs_path, _ in changed]):
+            # Broken packages are recorded with an empty stanza, so they
+            # are not looked at again until they are modified.
+            cache.update(
+                self._pool_path(abs_path),
+                stat_keys[abs_path],
+                str(control_data) if control_data is not None else ""
+            )
+        #end for
+
+        if not (changed or removed or self._force_full) and \
+                self._package_index_complete():
+            return
+
+        index = {}
+
+        for path, stat_key, stanza in sorted(cache.items()):
+            if not stanza:
+                continue
+
+            meta_data = DebianPackageMetaData(stanza)
+            name      = meta_data["Package"]
+            version   = meta_data["Version"]
+
+            index\
+                .setdefault(name, {})\
+                .setdefault(version, meta_data)
+        #end for
+
+        current_digest = None
+
+        # Only trust the recorded digest, if Packages.gz is still the file
+        # that was written on the last run.
+        if os.path.exists(packages_gz) and \
+                cache.get_meta("packages_gz_stat_key") == \
+                    IndexCache.stat_key(os.stat(packages_gz)):
+            current_digest = cache.get_meta("packages_gz_digest")
+        #end if
+
+        digest = self.store_package_index(index, current_digest=current_digest)
+
+        if digest and os.path.exists(packages_gz):
+            cache.set_meta("packages_gz_digest", digest)
+            cache.set_meta(
+                "packages_gz_stat_key",
+                IndexCache.stat_key(os.stat(packages_gz))
+            )
+        #end if
+    #end function
+
     def load_package_index(self):
         packages_file = os.path.join(self._repo_dir, "Packages.gz")
 
@@ -133,141 +318,163 @@ class RepoIndexer:
         #end for
 
         if not meta_data_list:
-            return
+            return None
 
-        text_output = "\n".join([str(entry) for entry in meta_data_list])
-        byte_output = text_output.encode("utf-8")
+        if self._sign_with:
+            signer = self._create_usign_signature_for_file
+        else:
+            signer = None
+
+        # Stanzas are streamed into all compressors and, if requested, the
+        # signed variant at the same time.
+        with PackageIndexWriter(self._repo_dir,
+                compression=self._compression, signer=signer,
+                threads=self._jobs) as writer:
+            for i, entry in enumerate(meta_data_list):
+                if i > 0:
+                    writer.write("\n")
+                writer.write(str(entry))
+            #end for
+
+            digest, _ = writer.commit(current_digest=current_digest)
+            index_files = writer.files
+        #end with
 
-        signature = None
-        signed_output = None
+        published = []
 
-        if self._sign_with:
-            signature = self._create_usign_signature(byte_output)
-
-            signed_output = (
-"""\
------BEGIN SIGNIFY SIGNED MESSAGE-----
-{output}\
------BEGIN SIGNIFY SIGNATURE-----
-{signature}\
------END SIGNIFY SIGNATURE-----
-"""
-            ) \
-            .format(
-                output=text_output,
-                signature=signature
-            ) \
-            .encode("utf-8")
+        if self._by_hash:
+            for filename in index_files:
+                published.append(self._store_by_hash(filename))
         #end if
 
-        changed = True
+        if self._shard_by:
+            published.extend(self.store_package_shards(meta_data_list))
 
-        if current_digest is not None:
-            h = hashlib.sha256()
-            h.update(byte_output)
-            if h.hexdigest() == current_digest:
-                changed = False
+        if self._by_hash:
+            self._prune_by_hash(published)
 
-        packages_gz  = os.path.join(self._repo_dir, "Packages.gz")
-        tempfile_gz  = None
-        packages_sig = os.path.join(self._repo_dir, "Packages.sig")
-        tempfile_sig = None
-        packages_in  = os.path.join(self._repo_dir, "InPackages.gz")
-        tempfile_in  = None
+        return digest
+    #end function
 
-        options = [("gzip", "timestamp", None)]
+    def store_package_shards(self, meta_data_list):
+        shards = {}
 
-        try:
-            if changed:
-                with NamedTemporaryFile(dir=self._repo_dir, delete=False) \
-                        as tempfile_gz:
-                    pass
-
-                with ArchiveFileWriter(
-                        tempfile_gz.name,
-                        libarchive.FORMAT_RAW,
-                        libarchive.COMPRESSION_GZIP,
-                        options=options) as archive:
-
-                    with ArchiveEntry() as archive_entry:
-                        archive_entry.filetype = stat.S_IFREG
-                        archive.write_entry(archive_entry)
-                        archive.write_data(byte_output)
-                    #end with
-                #end with
+        for meta_data in meta_data_list:
+            shards.setdefault(self._shard_key(meta_data), [])\
+                .append(meta_data)
+        #end for
 
-                os.chmod(
-                    tempfile_gz.name,
-                    stat.S_IRUSR |
-                    stat.S_IWUSR |
-                    stat.S_IRGRP |
-                    stat.S_IROTH
-                )
-            #end if
+        shards_dir = os.path.join(self._repo_dir, "shards")
+        manifest   = []
+        published  = []
 
-            if signature and signed_output:
-                if changed or not os.path.exists(packages_in):
-                    with NamedTemporaryFile(dir=self._repo_dir, delete=False) \
-                            as tempfile_in:
-                        pass
-
-                    with ArchiveFileWriter(
-                            tempfile_in.name,
-                            libarchive.FORMAT_RAW,
-                            libarchive.COMPRESSION_GZIP,
-                            options=options) as archive:
-
-                        with ArchiveEntry() as archive_entry:
-                            archive_entry.filetype = stat.S_IFREG
-                            archive.write_entry(archive_entry)
-                            archive.write_data(signed_output)
-                        #end with
-                    #end with
-
-                    os.chmod(
-                        tempfile_in.name,
-                        stat.S_IRUSR |
-                        stat.S_IWUSR |
-                        stat.S_IRGRP |
-                        stat.S_IROTH
-                    )
-                #end if
-
-                if changed or not os.path.exists(packages_sig):
-                    with NamedTemporaryFile(dir=self._repo_dir, mode="w+",
-                            delete=False, encoding="utf-8") as tempfile_sig:
-                        tempfile_sig.write(signature)
-
-                    os.chmod(
-                        tempfile_sig.name,
-                        stat.S_IRUSR |
-                        stat.S_IWUSR |
-                        stat.S_IRGRP |
-                        stat.S_IROTH
-                    )
-                #end if
-            #end if
+        for key in sorted(shards.keys()):
+            byte_output = "\n".join([str(entry) for entry in shards[key]])\
+                .encode("utf-8")
 
-            if tempfile_gz:
-                os.rename(tempfile_gz.name, packages_gz)
-            if tempfile_sig:
-                os.rename(tempfile_sig.name, packages_sig)
-            if tempfile_in:
-                os.rename(tempfile_in.name, packages_in)
-        finally:
-            if tempfile_gz and os.path.exists(tempfile_gz.name):
-                os.unlink(tempfile_gz.name)
-            if tempfile_sig and os.path.exists(tempfile_sig.name):
-                os.unlink(tempfile_sig.name)
-            if tempfile_in and os.path.exists(tempfile_in.name):
-                os.unlink(tempfile_in.name)
-        #end try
+            shard_file = os.path.join(shards_dir, key, "Packages.gz")
+            os.makedirs(os.path.dirname(shard_file), exist_ok=True)
+            self._write_gzip_file(shard_file, byte_output)
+
+            if self._by_hash:
+                published.append(self._store_by_hash(shard_file))
+
+            manifest.append(shard_file)
+        #end for
+
+        # Remove shards that have no packages anymore.
+        for key in os.listdir(shards_dir):
+            if key in shards:
+                continue
+
+            stale_file = os.path.join(shards_dir, key, "Packages.gz")
+            if os.path.exists(stale_file):
+                os.unlink(stale_file)
+            try:
+                os.rmdir(os.path.join(shards_dir, key))
+            except OSError:
+                pass
+        #end for
+
+        text_output = "Shard-By: {}\nSHA256:\n".format(self._shard_by)
+
+        for filename in self._index_files() + manifest:
+            sha256sum, size = self._file_sha256_sum_and_size(filename)
+            text_output += " {} {} {}\n".format(
+                sha256sum, size, self._pool_path(filename)
+            )
+        #end for
+
+        byte_output = text_output.encode("utf-8")
+
+        manifest_file = os.path.join(self._repo_dir, "Packages.manifest")
+        manifest_sig  = os.path.join(self._repo_dir, "Packages.manifest.sig")
+
+        changed = self._write_file(manifest_file, byte_output)
+
+        if self._sign_with and (changed or not os.path.exists(manifest_sig)):
+            self._write_file(
+                manifest_sig,
+                self._create_usign_signature(byte_output).encode("utf-8")
+            )
+        #end if
+
+        return published
     #end function
 
     def scan(self, index=None):
         if index is None:
             index = {}
 
+        pkg_files = self._find_new_packages(index)
+
+        for _, control_data in self._extract_control_data_from_files(
+                pkg_files):
+            if control_data is not None:
+                yield control_data
+        #end for
+    #end function
+
+    def extract_control_data(self, filename):
+        meta_data = None
+
+        with open(filename, "rb") as f:
+            reader = RepoIndexer.DigestReader(f, hashlib.sha256())
+
+            # The package is read exactly once. The control tarball is
+            # passed on in memory, the rest is only run through the digest.
+            with ArchiveFileReader(reader, buf_size=64*1024) as archive:
+                for entry in archive:
+                    if not entry.pathname.startswith("control.tar."):
+                        continue
+
+                    meta_data = DebianPackageMetaData(
+                        self._extract_control_data(archive.read_data()))
+
+                    meta_data["Filename"] = self._pool_path(filename)
+
+                    break
+                #end for
+            #end with
+
+            reader.drain()
+        #end with
+
+        if meta_data is None:
+            raise BoltSyntaxError(
+                "no control data found in '{}'.".format(filename)
+            )
+        #end if
+
+        meta_data["SHA256"] = reader.digest.hexdigest()
+        meta_data["Size"]   = reader.bytes_read
+
+        return meta_data
+    #end function
+
+    # PRIVATE
+
+    def _find_packages(self):
         for path, dirs, files in os.walk(self._repo_dir, followlinks=True):
             for filename in files:
                 if not filename.endswith(".bolt"):
@@ -278,69 +485,298 @@ class RepoIndexer:
                 except ValueError:
                     continue
 
-                entry = index.get(name, {}).get(version, None)
+                yield os.path.join(path, filename)
+            #end for
+        #end for
+    #end function
 
-                if entry is not None:
-                    continue
+    def _find_new_packages(self, index):
+        for abs_path in self._find_packages():
+            name, version, arch = \
+                os.path.basename(abs_path)[:-5].rsplit("_")
+
+            if index.get(name, {}).get(version, None) is not None:
+                continue
+
+            yield abs_path
+        #end for
+    #end function
+
+    def _extract_control_data_from_files(self, pkg_files):
+        memo = self._memo if self._memo is not None else {}
+        keys = {}
+        todo = {}
+
+        pkg_files = list(pkg_files)
+
+        # Files reached through more than one path, e.g. via symlinks into
+        # a shared pool, are only read once.
+        for filename in pkg_files:
+            try:
+                key = (
+                    os.path.realpath(filename),
+                    IndexCache.stat_key(os.stat(filename))
+                )
+            except OSError:
+                key = (filename, None)
+
+            keys[filename] = key
+
+            if key not in memo:
+                todo.setdefault(key, filename)
+        #end for
+
+        for key, control_data in zip(todo.keys(),
+                self._map_extract_control_data(list(todo.values()))):
+            memo[key] = control_data
+        #end for
+
+        for filename in pkg_files:
+            key = keys[filename]
+            control_data = memo[key]
 
-                abs_path = os.path.join(path, filename)
+            if control_data is not None and todo.get(key) != filename:
+                control_data = DebianPackageMetaData(str(control_data))
+                control_data["Filename"] = self._pool_path(filename)
+            #end if
+
+            yield filename, control_data
+        #end for
+    #end function
+
+    def _map_extract_control_data(self, pkg_files):
+        if self._executor is None and self._jobs <= 1:
+            return map(self._try_extract_control_data, pkg_files)
+
+        # Hand out work in batches to keep IPC overhead in check. The
+        # results are returned in submission order, which keeps the scan
+        # deterministic regardless of the number of workers.
+        chunksize = max(1, min(64, len(pkg_files) // (self._jobs * 4)))
+
+        if self._executor is not None:
+            return self._executor.map(
+                self._try_extract_control_data,
+                pkg_files,
+                chunksize=chunksize
+            )
+        #end if
+
+        with ProcessPoolExecutor(max_workers=self._jobs) as executor:
+            return list(
+                executor.map(
+                    self._try_extract_control_data,
+                    pkg_files,
+                    chunksize=chunksize
+                )
+            )
+        #end with
+    #end function
+
+    def _seed_cache_from_package_index(self, cache):
+        index, digest = self.load_package_index()
+
+        # Take over the entries of an index that was created without a
+        # cache, for as long as the package files are still around.
+        for name, versions in index.items():
+            for version, meta_data in versions.items():
+                path = meta_data["Filename"]
 
                 try:
-                    control_data = self.extract_control_data(abs_path)
-                except BoltSyntaxError:
+                    stats = os.stat(os.path.join(self._repo_dir, path))
+                except OSError:
                     continue
 
-                yield control_data
+                cache.update(path, IndexCache.stat_key(stats), str(meta_data))
             #end for
         #end for
+
+        packages_gz = os.path.join(self._repo_dir, "Packages.gz")
+
+        cache.set_meta("packages_gz_digest", digest)
+        cache.set_meta(
+            "packages_gz_stat_key", IndexCache.stat_key(os.stat(packages_gz))
+        )
     #end function
 
-    def extract_control_data(self, filename):
-        meta_data = None
+    def _index_files(self):
+        index_files = []
 
-        with TemporaryDirectory() as tmpdir:
-            with ArchiveFileReader(filename) as archive:
-                for entry in archive:
-                    if not entry.pathname.startswith("control.tar."):
-                        continue
+        for fmt in self._compression:
+            ext = PackageIndexWriter.COMPRESSION_FORMATS[fmt][0]
+            index_files.append(os.path.join(self._repo_dir, "Packages" + ext))
+        #end for
 
-                    data_file = os.path.join(tmpdir, entry.pathname)
+        return index_files
+    #end function
 
-                    with open(data_file, "wb+") as outfile:
-                        while True:
-                            buf = archive.read_data(4096)
-                            if not buf:
-                                break
-                            outfile.write(buf)
-                        #end while
-                    #end with
+    def _package_index_complete(self):
+        index_files = self._index_files()
 
-                    pool_path = re.sub(
-                        r"^" + re.escape(self._repo_dir) + r"/*",
-                        "",
-                        filename
-                    )
+        if self._sign_with:
+            index_files.append("Packages.sig")
+            for fmt in self._compression:
+                ext = PackageIndexWriter.COMPRESSION_FORMATS[fmt][0]
+                index_files.append("InPackages" + ext)
+            #end for
+        #end if
+        if self._shard_by:
+            index_files.append("Packages.manifest")
+            if self._sign_with:
+                index_files.append("Packages.manifest.sig")
+        if self._by_hash:
+            index_files.append(os.path.join("by-hash", "SHA256"))
+
+        for filename in index_files:
+            if not os.path.exists(os.path.join(self._repo_dir, filename)):
+                return False
+
+        return True
+    #end function
 
-                    meta_data = DebianPackageMetaData(
-                        self._extract_control_data(data_file))
+    def _shard_key(self, meta_data):
+        if self._shard_by == "section":
+            key = meta_data.get("Section") or "unknown"
+        else:
+            name = meta_data["Package"]
+            if len(name) > 3 and name.startswith("lib"):
+                key = name[0:4]
+            else:
+                key = name[0]
+        #end if
 
-                    meta_data["Filename"] = pool_path
+        return re.sub(r"[^a-zA-Z0-9+.-]", "-", key.lower())
+    #end function
 
-                    break
-                #end for
+    def _store_by_hash(self, filename):
+        sha256sum, _ = self._file_sha256_sum_and_size(filename)
+
+        by_hash_dir = os.path.join(self._repo_dir, "by-hash", "SHA256")
+        by_hash_file = os.path.join(by_hash_dir, sha256sum)
+
+        if os.path.exists(by_hash_file):
+            return sha256sum
+
+        os.makedirs(by_hash_dir, exist_ok=True)
+
+        with NamedTemporaryFile(dir=by_hash_dir, delete=False) as tempfile:
+            pass
+
+        try:
+            os.unlink(tempfile.name)
+            try:
+                os.link(filename, tempfile.name)
+            except OSError:
+                shutil.copy2(filename, tempfile.name)
+            os.rename(tempfile.name, by_hash_file)
+        finally:
+            if os.path.exists(tempfile.name):
+                os.unlink(tempfile.name)
+        #end try
+
+        return sha256sum
+    #end function
+
+    def _prune_by_hash(self, published):
+        by_hash_dir = os.path.join(self._repo_dir, "by-hash", "SHA256")
+        deadline = time.time() - RepoIndexer.BY_HASH_RETENTION
+
+        if not os.path.isdir(by_hash_dir):
+            return
+
+        # Entries are hardlinks, so the ctime records when the index file
+        # they were published for was last replaced.
+        for entry in os.scandir(by_hash_dir):
+            if entry.name in published:
+                continue
+
+            stats = entry.stat(follow_symlinks=False)
+
+            if stats.st_nlink > 1 or stats.st_ctime > deadline:
+                continue
+
+            os.unlink(entry.path)
+        #end for
+    #end function
+
+    def _write_gzip_file(self, filename, data):
+        with NamedTemporaryFile(dir=os.path.dirname(filename), delete=False) \
+                as tempfile:
+            pass
+
+        try:
+            with ArchiveFileWriter(
+                    tempfile.name,
+                    libarchive.FORMAT_RAW,
+                    libarchive.COMPRESSION_GZIP,
+                    options=[("gzip", "timestamp", None)]) as archive:
+
+                with ArchiveEntry() as archive_entry:
+                    archive_entry.filetype = stat.S_IFREG
+                    archive.write_entry(archive_entry)
+                    archive.write_data(data)
+                #end with
             #end with
-        #end with
 
-        meta_data["SHA256"] = self._file_sha256_sum(filename)
-        meta_data["Size"]   = os.path.getsize(filename)
+            return self._replace_file_if_changed(tempfile.name, filename)
+        finally:
+            if os.path.exists(tempfile.name):
+                os.unlink(tempfile.name)
+        #end try
+    #end function
 
-        return meta_data
+    def _write_file(self, filename, data):
+        with NamedTemporaryFile(dir=os.path.dirname(filename), delete=False) \
+                as tempfile:
+            tempfile.write(data)
+
+        try:
+            return self._replace_file_if_changed(tempfile.name, filename)
+        finally:
+            if os.path.exists(tempfile.name):
+                os.unlink(tempfile.name)
+        #end try
     #end function
 
-    # PRIVATE
+    def _replace_file_if_changed(self, tempfile, filename):
+        if os.path.exists(filename) and \
+                self._file_sha256_sum_and_size(tempfile, memoize=False) == \
+                    self._file_sha256_sum_and_size(filename):
+            return False
+        #end if
+
+        os.chmod(
+            tempfile,
+            stat.S_IRUSR |
+            stat.S_IWUSR |
+            stat.S_IRGRP |
+            stat.S_IROTH
+        )
+
+        os.rename(tempfile, filename)
+        return True
+    #end function
+
+    def _file_sha256_sum_and_size(self, filename, memoize=True):
+        return FileHasher.instance().sha256_and_size(
+            filename, memoize=memoize
+        )
+    #end function
+
+    def _pool_path(self, filename):
+        return re.sub(
+            r"^" + re.escape(self._repo_dir) + r"/*", "", filename
+        )
+    #end function
+
+    def _try_extract_control_data(self, filename):
+        try:
+            return self.extract_control_data(filename)
+        except BoltSyntaxError:
+            return None
+    #end function
 
-    def _extract_control_data(self, filename):
-        with ArchiveFileReader(filename) as archive:
+    def _extract_control_data(self, control_tar):
+        with ArchiveFileReader(control_tar) as archive:
             for entry in archive:
                 if not entry.pathname == "control":
                     continue
@@ -357,44 +793,36 @@ class RepoIndexer:
         #end with
     #end function
 
-    def _file_sha256_sum(self, filename):
-        h = hashlib.sha256()
-        with open(filename, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                h.update(chunk)
-        return h.hexdigest()
-    #end function
-
     def _create_usign_signature(self, data):
-        signature = None
-
         with NamedTemporaryFile(dir=self._repo_dir) as tempfile:
             tempfile.write(data)
             tempfile.flush()
 
-            sign_cmd = shlex.split(
-                "usign -S -m '{}' -s '{}' -x -".format(
-                    tempfile.name, self._sign_with
-                )
-            )
-            try:
-                proc = subprocess.run(
-                    sign_cmd,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    check=True
-                )
-                signature = proc.stdout.decode("utf-8")
-            except subprocess.CalledProcessError as e:
-                raise BoltError(
-                    "failed to sign Packages file: {}"
-                    .format(e.stderr.decode(locale.getpreferredencoding(False))
-                        .strip())
-                )
-            #end try
+            return self._create_usign_signature_for_file(tempfile.name)
         #end with
+    #end function
+
+    def _create_usign_signature_for_file(self, filename):
+        sign_cmd = shlex.split(
+            "usign -S -m '{}' -s '{}' -x -".format(filename, self._sign_with)
+        )
+
+        try:
+            proc = subprocess.run(
+                sign_cmd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                check=True
+            )
+        except subprocess.CalledProcessError as e:
+            raise BoltError(
+                "failed to sign Packages file: {}"
+                .format(e.stderr.decode(locale.getpreferredencoding(False))
+                    .strip())
+            )
+        #end try
 
-        return signature
+        return proc.stdout.decode("utf-8")
     #end function
 
 #end class
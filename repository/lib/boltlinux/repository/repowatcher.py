@@ -0,0 +1,194 @@
+# -*- encoding: utf-8 -*-
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2021 Tobias Koch <tobias.koch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+import logging
+import os
+import time
+
+from boltlinux.miscellaneous.inotify import Inotify, InotifyError
+from boltlinux.miscellaneous.workerthread import WorkerThread
+
+LOGGER = logging.getLogger(__name__)
+
+class RepoWatcher(WorkerThread):
+
+    WATCH_MASK = \
+        Inotify.IN_CLOSE_WRITE | \
+        Inotify.IN_MOVED_FROM  | \
+        Inotify.IN_MOVED_TO    | \
+        Inotify.IN_CREATE      | \
+        Inotify.IN_DELETE      | \
+        Inotify.IN_ONLYDIR
+
+    # Written by the indexer itself, changes in there must not trigger
+    # another reindex.
+    INDEX_DIRS = ["by-hash", "shards"]
+
+    def __init__(self, indexer, repo_dir, poll_interval=None, debounce=2.0,
+            max_delay=30.0, retry_interval=30.0):
+        super().__init__("repo-watcher", retry_interval)
+
+        self._indexer       = indexer
+        self._repo_dir      = repo_dir
+        self._poll_interval = poll_interval
+        self._debounce      = debounce
+        self._max_delay     = max_delay
+    #end function
+
+    def work(self):
+        if self._poll_interval:
+            self._watch_by_polling(self._poll_interval)
+            return
+        #end if
+
+        try:
+            inotify = Inotify()
+        except InotifyError as e:
+            LOGGER.warning(
+                "{}, falling back to polling every 60s.".format(str(e))
+            )
+            self._watch_by_polling(60.0)
+            return
+        #end try
+
+        with inotify:
+            self._watch_with_inotify(inotify)
+    #end function
+
+    # PRIVATE
+
+    def _watch_by_polling(self, interval):
+        self._update_package_index()
+
+        while not self._stop_event.wait(timeout=interval):
+            self._update_package_index()
+    #end function
+
+    def _watch_with_inotify(self, inotify):
+        # Set up the watches first, so that nothing is missed between the
+        # initial update and the start of the event loop.
+        self._add_watches(inotify, self._repo_dir)
+        self._update_package_index()
+
+        first_event = None
+        last_event  = None
+
+        while not self.is_stopped():
+            if first_event is None:
+                timeout = 1.0
+            else:
+                now = time.monotonic()
+                timeout = max(0.0, min(
+                    self._debounce - (now - last_event),
+                    self._max_delay - (now - first_event),
+                    1.0
+                ))
+            #end if
+
+            if self._handle_events(inotify, inotify.read_events(timeout)):
+                last_event = time.monotonic()
+                if first_event is None:
+                    first_event = last_event
+            #end if
+
+            if first_event is None:
+                continue
+
+            # Wait for a burst of changes to settle before reindexing, but
+            # not forever if packages keep coming in.
+            now = time.monotonic()
+
+            if now - last_event >= self._debounce or \
+                    now - first_event >= self._max_delay:
+                first_event = None
+                last_event  = None
+                self._update_package_index()
+            #end if
+        #end while
+    #end function
+
+    def _handle_events(self, inotify, events):
+        relevant = False
+
+        for event in events:
+            if event.mask & Inotify.IN_Q_OVERFLOW:
+                LOGGER.warning("inotify event queue overflow, rescanning.")
+                self._add_watches(inotify, self._repo_dir)
+                relevant = True
+            elif event.is_dir:
+                if self._is_index_dir(event.pathname):
+                    continue
+                if event.mask & (Inotify.IN_CREATE | Inotify.IN_MOVED_TO):
+                    self._add_watches(inotify, event.pathname)
+                relevant = True
+            elif event.name.endswith(".bolt"):
+                relevant = True
+            #end if
+        #end for
+
+        return relevant
+    #end function
+
+    def _add_watches(self, inotify, top_dir):
+        visited = set()
+
+        for path, dirs, files in os.walk(top_dir, followlinks=True):
+            real_path = os.path.realpath(path)
+
+            if real_path in visited:
+                dirs.clear()
+                continue
+            #end if
+
+            visited.add(real_path)
+
+            dirs[:] = [
+                d for d in dirs
+                    if not self._is_index_dir(os.path.join(path, d))
+            ]
+
+            try:
+                inotify.add_watch(path, RepoWatcher.WATCH_MASK)
+            except InotifyError as e:
+                LOGGER.warning(str(e))
+        #end for
+    #end function
+
+    def _is_index_dir(self, path):
+        rel_path = os.path.relpath(path, self._repo_dir)
+
+        return rel_path.split(os.sep)[0] in RepoWatcher.INDEX_DIRS
+    #end function
+
+    def _update_package_index(self):
+        start = time.monotonic()
+        self._indexer.update_package_index()
+        LOGGER.info(
+            "updated package index in {:.2f}s."
+            .format(time.monotonic() - start)
+        )
+    #end function
+
+#end class